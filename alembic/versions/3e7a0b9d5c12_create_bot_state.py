@@ -0,0 +1,28 @@
+"""create bot state
+
+Revision ID: 3e7a0b9d5c12
+Revises: b8d4e2f71c05
+Create Date: 2026-10-18 13:52:40.118503
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7a0b9d5c12'
+down_revision = 'b8d4e2f71c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "bot_state",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("value", sa.String()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("bot_state")
@@ -0,0 +1,67 @@
+"""add hot query indexes
+
+Revision ID: 4f2a9c1d7e3b
+Revises: c0371059db69
+Create Date: 2026-10-18 10:12:41.503318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c1d7e3b'
+down_revision = 'c0371059db69'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, unique)
+INDEXES = [
+    ("ix_users_user_id", "users", ["user_id"], True),
+    ("ix_users_name", "users", ["name"], False),
+    ("ix_users_last_active", "users", ["last_active"], False),
+    ("ix_exercises_user_id_name_date", "exercises", ["user_id", "name", "date"], False),
+    ("ix_exercises_user_id_date", "exercises", ["user_id", "date"], False),
+]
+
+
+def _built_indexes(bind):
+    """{name: valid} for the INDEXES a previous, interrupted run left behind."""
+    if bind.dialect.name != "postgresql":
+        return {}
+    return dict(bind.execute(sa.text(
+        "SELECT c.relname, i.indisvalid FROM pg_index i"
+        " JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = ANY(:names)"),
+        {"names": [name for name, _, _, _ in INDEXES]}).all())
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # registrations used to race, so there may be several rows per Discord account
+    duplicates = bind.execute(sa.text(
+        "SELECT user_id FROM users GROUP BY user_id HAVING count(*) > 1"
+        " ORDER BY user_id LIMIT 10")).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            f"users has more than one row for the Discord ids {duplicates} (the first"
+            " 10 at most), so ix_users_user_id can't be unique. Merge or delete the"
+            " extra rows, then run the upgrade again.")
+    built = _built_indexes(bind)
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, but it keeps the
+    # tables writable while the release phase builds the indexes. A build that fails
+    # leaves an INVALID index behind, which is dropped so the upgrade can be rerun.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            if built.get(name):
+                continue
+            if name in built:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+            op.create_index(name, table, columns, unique=unique,
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
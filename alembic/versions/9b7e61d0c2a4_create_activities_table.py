@@ -0,0 +1,66 @@
+"""create activities table
+
+Moves activity definitions out of the zero-rep marker rows in exercises and into
+their own table, which the exercise log now references by foreign key.
+
+Revision ID: 9b7e61d0c2a4
+Revises: 4f2a9c1d7e3b
+Create Date: 2026-10-18 11:02:17.228914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b7e61d0c2a4'
+down_revision = '4f2a9c1d7e3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "activities",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("unit", sa.String()),
+        sa.Column("date_created", sa.DateTime()),
+        sa.Column("user_id", sa.Integer(),
+                  sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.UniqueConstraint("user_id", "name", name="uq_activities_user_id_name"),
+    )
+    # one activity per (user, name); the marker row carries the unit and creation date
+    op.execute("INSERT INTO activities (user_id, name, unit, date_created)"
+               " SELECT user_id, name, MAX(unit), MIN(date) FROM exercises"
+               " WHERE user_id IS NOT NULL GROUP BY user_id, name")
+    op.add_column("exercises", sa.Column("activity_id", sa.Integer(),
+                                         sa.ForeignKey("activities.id",
+                                                       ondelete="CASCADE")))
+    op.execute("UPDATE exercises SET activity_id ="
+               " (SELECT activities.id FROM activities"
+               " WHERE activities.user_id = exercises.user_id"
+               " AND activities.name = exercises.name)")
+    # zero-rep rows were only ever activity markers, and orphans have no owner
+    op.execute("DELETE FROM exercises WHERE reps = 0 OR activity_id IS NULL")
+    op.alter_column("exercises", "activity_id", nullable=False)
+    op.drop_index("ix_exercises_user_id_name_date", table_name="exercises")
+    op.create_index("ix_exercises_activity_id_date", "exercises",
+                    ["activity_id", "date"])
+    op.drop_column("exercises", "name")
+    op.drop_column("exercises", "unit")
+
+
+def downgrade() -> None:
+    op.add_column("exercises", sa.Column("name", sa.String()))
+    op.add_column("exercises", sa.Column("unit", sa.String()))
+    op.execute("UPDATE exercises SET name = activities.name, unit = activities.unit"
+               " FROM activities WHERE activities.id = exercises.activity_id")
+    op.execute("INSERT INTO exercises (name, unit, reps, date, user_id, activity_id)"
+               " SELECT name, unit, 0, date_created, user_id, id FROM activities")
+    op.alter_column("exercises", "name", nullable=False)
+    op.drop_index("ix_exercises_activity_id_date", table_name="exercises")
+    op.create_index("ix_exercises_user_id_name_date", "exercises",
+                    ["user_id", "name", "date"])
+    op.drop_column("exercises", "activity_id")
+    op.drop_table("activities")
@@ -0,0 +1,113 @@
+"""partition exercises by month
+
+On Postgres the exercise log becomes a table range-partitioned by month on date, with
+a DEFAULT partition catching anything outside the monthly ones. GainsClock creates the
+upcoming partitions and archives old ones into exercise_archive.
+
+Revision ID: a5d03c7f1e62
+Revises: e31c58a4b9f0
+Create Date: 2026-10-18 12:31:05.662470
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d03c7f1e62'
+down_revision = 'e31c58a4b9f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "exercise_archive",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(),
+                  sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("month", sa.Date(), nullable=False),
+        sa.Column("row_count", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+    )
+    op.create_index("ix_exercise_archive_user_id_month", "exercise_archive",
+                    ["user_id", "month"])
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # The partition key has to be part of the primary key, so date can't be null.
+    op.execute("UPDATE exercises SET date = COALESCE("
+               "(SELECT date_created FROM activities"
+               " WHERE activities.id = exercises.activity_id), now())"
+               " WHERE date IS NULL")
+    op.execute("ALTER TABLE exercises RENAME TO exercises_unpartitioned")
+    op.execute("ALTER TABLE exercises_unpartitioned"
+               " RENAME CONSTRAINT exercises_pkey TO exercises_unpartitioned_pkey")
+    op.drop_index("ix_exercises_activity_id_date", table_name="exercises_unpartitioned")
+    op.drop_index("ix_exercises_user_id_date", table_name="exercises_unpartitioned")
+    op.execute("""
+        CREATE TABLE exercises (
+            id integer NOT NULL DEFAULT nextval('exercises_id_seq'),
+            reps numeric(12, 2),
+            date timestamp without time zone NOT NULL,
+            user_id integer REFERENCES users (id) ON DELETE CASCADE,
+            activity_id integer NOT NULL REFERENCES activities (id) ON DELETE CASCADE,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute("CREATE TABLE exercises_default PARTITION OF exercises DEFAULT")
+    # one partition per month of existing data, plus the next two months
+    op.execute("""
+        DO $$
+        DECLARE
+            month timestamp := date_trunc('month', COALESCE(
+                (SELECT MIN(date) FROM exercises_unpartitioned), now()));
+        BEGIN
+            WHILE month <= date_trunc('month', now()) + interval '2 months' LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF exercises'
+                               ' FOR VALUES FROM (%L) TO (%L)',
+                               'exercises_y' || to_char(month, 'YYYY"m"MM'),
+                               month, month + interval '1 month');
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+    op.execute("INSERT INTO exercises (id, reps, date, user_id, activity_id)"
+               " SELECT id, reps, date, user_id, activity_id"
+               " FROM exercises_unpartitioned")
+    op.execute("ALTER SEQUENCE exercises_id_seq OWNED BY exercises.id")
+    op.drop_table("exercises_unpartitioned")
+    op.create_index("ix_exercises_activity_id_date", "exercises",
+                    ["activity_id", "date"])
+    op.create_index("ix_exercises_user_id_date", "exercises", ["user_id", "date"])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE exercises RENAME TO exercises_partitioned")
+        op.execute("ALTER TABLE exercises_partitioned"
+                   " RENAME CONSTRAINT exercises_pkey TO exercises_partitioned_pkey")
+        op.drop_index("ix_exercises_activity_id_date",
+                      table_name="exercises_partitioned")
+        op.drop_index("ix_exercises_user_id_date", table_name="exercises_partitioned")
+        op.execute("""
+            CREATE TABLE exercises (
+                id integer PRIMARY KEY DEFAULT nextval('exercises_id_seq'),
+                reps numeric(12, 2),
+                date timestamp without time zone,
+                user_id integer REFERENCES users (id) ON DELETE CASCADE,
+                activity_id integer NOT NULL
+                    REFERENCES activities (id) ON DELETE CASCADE
+            )
+        """)
+        # archived rows are not restored, they stay readable through the daily rollup
+        op.execute("INSERT INTO exercises (id, reps, date, user_id, activity_id)"
+                   " SELECT id, reps, date, user_id, activity_id"
+                   " FROM exercises_partitioned")
+        op.execute("ALTER SEQUENCE exercises_id_seq OWNED BY exercises.id")
+        op.drop_table("exercises_partitioned")
+        op.create_index("ix_exercises_activity_id_date", "exercises",
+                        ["activity_id", "date"])
+        op.create_index("ix_exercises_user_id_date", "exercises", ["user_id", "date"])
+    op.drop_index("ix_exercise_archive_user_id_month", table_name="exercise_archive")
+    op.drop_table("exercise_archive")
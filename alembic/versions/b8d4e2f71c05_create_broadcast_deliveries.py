@@ -0,0 +1,34 @@
+"""create broadcast deliveries
+
+Revision ID: b8d4e2f71c05
+Revises: a5d03c7f1e62
+Create Date: 2026-10-18 13:31:12.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4e2f71c05'
+down_revision = 'a5d03c7f1e62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "broadcast_deliveries",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("version", sa.String(), nullable=False),
+        sa.Column("guild_id", sa.BigInteger(), nullable=False),
+        sa.Column("channel_id", sa.BigInteger()),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("date", sa.DateTime()),
+        sa.UniqueConstraint("version", "guild_id",
+                            name="uq_broadcast_deliveries_version_guild_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("broadcast_deliveries")
@@ -0,0 +1,41 @@
+"""create daily gains rollup
+
+The table is filled from the exercise log here, the owner-only `backfill_rollups`
+command rebuilds it later if it ever drifts.
+
+Revision ID: e31c58a4b9f0
+Revises: 9b7e61d0c2a4
+Create Date: 2026-10-18 11:47:53.810246
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e31c58a4b9f0'
+down_revision = '9b7e61d0c2a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "daily_gains",
+        sa.Column("activity_id", sa.Integer(),
+                  sa.ForeignKey("activities.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("user_id", sa.Integer(),
+                  sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("reps", sa.Numeric(precision=12, scale=2), nullable=False),
+    )
+    op.create_index("ix_daily_gains_user_id_day", "daily_gains", ["user_id", "day"])
+    op.execute("INSERT INTO daily_gains (activity_id, day, user_id, reps)"
+               " SELECT activity_id, date(date), user_id, sum(reps) FROM exercises"
+               " WHERE user_id IS NOT NULL"
+               " GROUP BY activity_id, date(date), user_id")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_daily_gains_user_id_day", table_name="daily_gains")
+    op.drop_table("daily_gains")
@@ -0,0 +1,94 @@
+"""
+Render time and memory of each /see_gains chart backend (see gainsworth.charts.render).
+
+    python -m benchmarks.chart_backend_benchmark --activities 5
+
+Each backend runs in its own process so their imports and memory don't mix; the RSS
+reported includes child processes, i.e. kaleido's browser for plotly (Linux only).
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import random
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from gainsworth.charts.buckets import pick_bucket
+from gainsworth.charts.backends import BACKENDS
+
+WINDOWS = [7, 365, 3650]
+
+
+def make_rows(days, activities, rng):
+    today = datetime.utcnow().date()
+    return [(today - timedelta(days=day), f"Activity{ii}", float(rng.randint(1, 100)))
+            for day in range(days + 1) for ii in range(activities)
+            if rng.random() < 0.3]
+
+
+def run_backend(backend, activities, repeat):
+    start = time.perf_counter()
+    from gainsworth.charts.render import render_chart, warm_up
+    warm_up(backend)
+    result = {"startup": time.perf_counter() - start}
+    rng = random.Random(7)
+    for days in WINDOWS:
+        rows = make_rows(days, activities, rng)
+        for plot_type in ["line", "histogram"]:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                render_chart(rows, days, plot_type, pick_bucket(days), backend)
+                timings.append((time.perf_counter() - start) * 1000)
+            result[f"{days}d {plot_type}"] = statistics.median(timings)
+    result["rss"] = _tree_rss(os.getpid()) / 1024
+    return result
+
+
+def _tree_rss(pid):
+    # KiB: peak RSS of pid plus the current RSS of its (still running) descendants
+    def status(pid, field):
+        with open(f"/proc/{pid}/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+    def children(pid):
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+
+    total, todo = status(pid, "VmHWM:"), children(pid)
+    while todo:
+        child = todo.pop()
+        total += status(child, "VmRSS:")
+        todo += children(child)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--activities", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backend", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(run_backend(args.backend, args.activities, args.repeat)))
+        return
+    for backend in BACKENDS:
+        out = subprocess.run([sys.executable, "-m",
+                              "benchmarks.chart_backend_benchmark",
+                              "--backend", backend,
+                              "--activities", str(args.activities),
+                              "--repeat", str(args.repeat)],
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{backend:>10}: startup {result.pop('startup'):5.2f}s,"
+              f" peak RSS {result.pop('rss'):6.1f} MiB")
+        for name, median in result.items():
+            print(f"{name:>24}: median {median:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
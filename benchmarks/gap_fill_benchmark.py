@@ -0,0 +1,83 @@
+"""
+Time taken to zero-fill /see_gains data, the old row-by-row add_populated_rows against
+charts.render.fill_gaps, for 7, 365 and 3650 day windows.
+
+    python -m benchmarks.gap_fill_benchmark --activities 20
+
+The old approach grows quadratically, so it's skipped for windows longer than
+--legacy-max-days (365 by default).
+"""
+import argparse
+from datetime import datetime, timedelta
+import random
+import statistics
+import time
+
+import pandas as pd
+
+from gainsworth.charts.render import fill_gaps
+
+
+WINDOWS = [7, 365, 3650]
+
+
+def make_gains(days, activities, rng):
+    today = datetime.utcnow().date()
+    rows = [(today - timedelta(days=day), f"Activity{ii}", float(rng.randint(1, 100)))
+            for day in range(days + 1) for ii in range(activities)
+            if rng.random() < 0.3]
+    gains = pd.DataFrame.from_records(rows, columns=["date", "name", "reps"])
+    gains["date"] = pd.to_datetime(gains["date"])
+    return gains
+
+
+def legacy_fill(subset, days):
+    # see_gains before fill_gaps
+    subset = subset.set_index('date')
+    end = datetime.utcnow()
+    start = (end-timedelta(days=days))
+    dates = pd.date_range(start=start, end=end, freq='D')
+    idx_df = pd.DataFrame(index=pd.DatetimeIndex(dates))
+    df = pd.merge(idx_df, subset, how='outer', left_index=True, right_index=True)
+    names = [n for n in df['name'].unique() if isinstance(n, str)]
+    for row in df['name'].isna().index:
+        ii = 0
+        for name in names:
+            ii += 1
+            df.loc[row + timedelta(seconds=ii)] = [name, 0.0]
+    df = df.dropna(subset=['name'])
+    return df.groupby([pd.Grouper(freq='D'), "name"]).sum().reset_index(level="name")
+
+
+def measure(fill, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fill()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--activities", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-max-days", type=int, default=365)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    for days in WINDOWS:
+        gains = make_gains(days, args.activities, rng)
+        start_day = pd.Timestamp((datetime.utcnow() - timedelta(days=days)).date())
+        end_day = pd.Timestamp(datetime.utcnow().date())
+        new = measure(lambda: fill_gaps(gains, start_day, end_day), args.repeat)
+        if days <= args.legacy_max_days:
+            old = f"{measure(lambda: legacy_fill(gains, days), 1):10.1f} ms"
+        else:
+            old = f"{'skipped':>13}"
+        print(f"{days:>5} days, {len(gains):>6} gains: add_populated_rows {old}"
+              f"   fill_gaps {new:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Query plans and latencies for Gainsworth's hot queries, before and after the
+indexes added in alembic revision 4f2a9c1d7e3b, on a synthetic exercise log.
+
+    python benchmarks/index_benchmark.py --rows 1000000 --users 10000
+
+Runs against BENCH_DATABASE_URL (a scratch SQLite file by default). The data lives in
+bench_users/bench_exercises tables that are dropped afterwards, but please point this
+at a scratch database anyway, not production.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+
+
+ACTIVITIES = ["Pushups", "Situps", "Squats", "Jogging", "Planks", "Burpees", "Pullups",
+              "Lunges"]
+
+INDEXES = [
+    "CREATE UNIQUE INDEX bench_ix_users_user_id ON bench_users (user_id)",
+    "CREATE INDEX bench_ix_users_name ON bench_users (name)",
+    "CREATE INDEX bench_ix_users_last_active ON bench_users (last_active)",
+    "CREATE INDEX bench_ix_exercises_user_id_name_date"
+    " ON bench_exercises (user_id, name, date)",
+    "CREATE INDEX bench_ix_exercises_user_id_date ON bench_exercises (user_id, date)",
+]
+
+QUERIES = {
+    "user lookup": "SELECT * FROM bench_users WHERE user_id = :discord_id",
+    "activity lookup": "SELECT * FROM bench_exercises WHERE user_id = :user_id"
+                       " AND name = :name LIMIT 1",
+    "list_gains totals": "SELECT name, unit, SUM(reps) FROM bench_exercises"
+                         " WHERE user_id = :user_id AND date >= :start"
+                         " GROUP BY name, unit",
+    "inactive scan": "SELECT id FROM bench_users WHERE last_active < :cutoff",
+}
+
+
+def create_data(conn, dialect, users, rows):
+    conn.execute(text("CREATE TABLE bench_users (id INTEGER PRIMARY KEY,"
+                      " user_id BIGINT NOT NULL, name VARCHAR NOT NULL,"
+                      " last_active TIMESTAMP)"))
+    conn.execute(text("CREATE TABLE bench_exercises (id INTEGER PRIMARY KEY,"
+                      " name VARCHAR NOT NULL, unit VARCHAR, reps NUMERIC(12, 2),"
+                      " date TIMESTAMP, user_id INTEGER)"))
+    pick = "CASE n % {} {} END".format(
+        len(ACTIVITIES),
+        " ".join(f"WHEN {ii} THEN '{name}'" for ii, name in enumerate(ACTIVITIES)))
+    if dialect == "postgresql":
+        series = "SELECT generate_series(1, :n) AS n"
+        ago = "now() - (n % 1500) * interval '1 day'"
+        sparse_ago = "now() - (n % 730) * interval '1 day'"
+    else:
+        series = ("WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq"
+                  " WHERE n < :n) SELECT n FROM seq")
+        ago = "datetime('now', '-' || (n % 1500) || ' days')"
+        sparse_ago = "datetime('now', '-' || (n % 730) || ' days')"
+    conn.execute(text(f"INSERT INTO bench_users (id, user_id, name, last_active)"
+                      f" SELECT n, 100000000000 + n, 'user' || n || '#0001',"
+                      f" {sparse_ago}"
+                      f" FROM ({series}) s"), {"n": users})
+    conn.execute(text(f"INSERT INTO bench_exercises"
+                      f" (id, name, unit, reps, date, user_id)"
+                      f" SELECT n, {pick}, NULL, n % 50, {ago},"
+                      f" 1 + (n * 7919) % {users}"
+                      f" FROM ({series}) s"), {"n": rows})
+
+
+def explain(conn, dialect, sql, params):
+    if dialect == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    else:
+        prefix = "EXPLAIN QUERY PLAN "
+    rows = conn.execute(text(prefix + sql), params).all()
+    return "\n".join("    " + " ".join(str(c) for c in row) for row in rows)
+
+
+def measure(conn, sql, make_params, repeat):
+    timings = []
+    for _ in range(repeat):
+        params = make_params()
+        start = time.perf_counter()
+        conn.execute(text(sql), params).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def report(conn, dialect, users, repeat, label):
+    print(f"\n=== {label} ===")
+    rng = random.Random(7)
+
+    def make_params():
+        user_id = rng.randint(1, users)
+        return {"discord_id": 100000000000 + user_id,
+                "user_id": user_id,
+                "name": rng.choice(ACTIVITIES),
+                "start": "2000-01-01" if rng.random() < 0.1 else _days_ago(7),
+                "cutoff": _days_ago(365)}
+
+    for name, sql in QUERIES.items():
+        median, p95 = measure(conn, sql, make_params, repeat)
+        print(f"{name:>18}: median {median:8.3f} ms   p95 {p95:8.3f} ms")
+        print(explain(conn, dialect, sql, make_params()))
+
+
+def _days_ago(days):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - days * 86400))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL", "sqlite:///bench_gainsworth.db")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    engine = create_engine(url)
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_exercises"))
+        conn.execute(text("DROP TABLE IF EXISTS bench_users"))
+        start = time.perf_counter()
+        create_data(conn, dialect, args.users, args.rows)
+        conn.execute(text("ANALYZE"))
+        print(f"Loaded {args.rows} exercises for {args.users} users on {dialect}"
+              f" in {time.perf_counter() - start:.1f}s")
+    try:
+        with engine.begin() as conn:
+            report(conn, dialect, args.users, args.repeat, "before indexes")
+            for statement in INDEXES:
+                conn.execute(text(statement))
+            conn.execute(text("ANALYZE"))
+            report(conn, dialect, args.users, args.repeat, "after indexes")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS bench_exercises"))
+            conn.execute(text("DROP TABLE IF EXISTS bench_users"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import asyncio
 import logging
 from pathlib import Path
-import sys
 import time
 
 import discord
@@ -9,39 +8,35 @@ import discord
 from decouple import config
 from discord.ext import commands
 
+from gainsworth.command_sync import sync_if_changed
+from gainsworth.db import crud
+from gainsworth.logs import setup_logging
+from gainsworth.sharding import SHARDED, runs_global_jobs, shard_options
+
+STARTED = time.perf_counter()
+AUTO_SYNC_COMMANDS = config("AUTO_SYNC_COMMANDS", default=False, cast=bool)
 ROOT_DIR = Path(__file__).resolve(strict=True).parent
 
-# Logging setup, cogs should ideally define their logger in their __init__.
+# Logging is set up in main (see logs.py), cogs should ideally define their logger in
+# their __init__.
 logger = logging.getLogger('gainsworth')
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('gainsworth_debug.log')
-file_handler.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-
-class Bot(commands.Bot):
+
+
+class Bot(commands.AutoShardedBot if SHARDED else commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix = config("DISCORD_PREFIX"), intents = discord.Intents.default())
+        super().__init__(command_prefix=config("DISCORD_PREFIX"),
+                         intents=discord.Intents.default(), **shard_options())
 
     async def on_ready(self):
         print(f"We have logged in as {self.user}.")
 
-
-    # #METHOD 1: "Auto-Syncing" (sync only when you need to: modifying app commands' server-end info, like their name or description) - ratelimit for syncing is twice per minute
-    # async def setup_hook(self):
-    #     # init = ROOT_DIR/"cogs"/"__init__.py"
-    #     # cogs = [cog for cog in (ROOT_DIR / "cogs").glob("*.py") if cog != init]
-    #     # for cog in cogs:
-    #     #     print(f"Found cog: 'cog.{cog.name[:-3]}'")
-    #     #     await self.load_extension(f"gainsworth.cogs.{cog.name[:-3]}")
-    #     await self.tree.sync(guild = discord.Object(id=740310401001980036)) #make this line a comment, if you don't need to sync
-    #     print("Synced!")
+    # "Auto-Syncing": syncs on startup, but only when the app commands' server-end info
+    # (name, description, parameters) changed since the last sync - the ratelimit for
+    # syncing is twice per minute
+    async def setup_hook(self):
+        # the tree is global, so one process syncs it when sharded
+        if AUTO_SYNC_COMMANDS and runs_global_jobs(self):
+            await sync_if_changed(self.tree)
 
 bot = Bot()
 
@@ -51,9 +46,17 @@ bot = Bot()
 async def load_cogs(b):
     init = ROOT_DIR/"cogs"/"__init__.py"
     cogs = [cog for cog in (ROOT_DIR / "cogs").glob("*.py") if cog != init]
+    timings = {}
     for cog in cogs:
         print(f"Found cog: 'cog.{cog.name[:-3]}'")
+        start = time.perf_counter()
         await b.load_extension(f"gainsworth.cogs.{cog.name[:-3]}")
+        timings[cog.name[:-3]] = time.perf_counter() - start
+    # slowest first, so whatever is worth making lazier stands out
+    for name, seconds in sorted(timings.items(), key=lambda timing: -timing[1]):
+        logger.info(f"loaded cog {name} in {seconds * 1000:.0f} ms")
+    logger.info(f"loaded {len(timings)} cogs in {sum(timings.values()):.2f}s,"
+                f" {time.perf_counter() - STARTED:.2f}s after startup")
 
 # @bot.event
 # async def on_ready():
@@ -67,10 +70,22 @@ async def load_cogs(b):
 
 
 async def main():
-    async with bot:
-        await load_cogs(bot)
-        await bot.start(config("DISCORD_BOT_KEY"))
-
-asyncio.run(main())
+    log_writer = setup_logging()
+    log_writer.start()
+    # closing the bot unloads the cogs, which may still write (see db/buffer.py), so the
+    # engine goes last, and the log writer after it to get everything they logged
+    try:
+        async with bot:
+            await load_cogs(bot)
+            await bot.start(config("DISCORD_BOT_KEY"))
+    finally:
+        await crud.dispose_engine()
+        log_writer.stop()
+
+
+# chart workers are spawned processes that import this module again, they mustn't
+# start a bot
+if __name__ == "__main__":
+    asyncio.run(main())
 
 # bot.run(config("DISCORD_BOT_KEY"))
\ No newline at end of file
@@ -0,0 +1,10 @@
+"""
+Chart backends by name, each a module with draw() and warm_up(), see render.py.
+Kept apart from render.py so the bot process can check a name without loading pandas.
+"""
+
+# backends are imported on first use, so plotly and kaleido stay optional
+BACKENDS = {
+    "matplotlib": "gainsworth.charts.matplotlib_backend",
+    "plotly": "gainsworth.charts.plotly_backend",
+}
@@ -0,0 +1,29 @@
+"""
+Time buckets /see_gains can plot gains in, coarser ones for longer windows so that no
+activity gets more than MAX_CHART_POINTS points. Kept apart from render.py so picking
+one doesn't need pandas.
+"""
+from collections import namedtuple
+
+from decouple import config
+
+
+Bucket = namedtuple("Bucket", ["days", "period", "adjective"])
+
+# period is the pandas period alias, buckets start on its first day (weeks on Mondays)
+BUCKETS = {
+    "day": Bucket(1, "D", "Daily"),
+    "week": Bucket(7, "W-SUN", "Weekly"),
+    "month": Bucket(30.44, "M", "Monthly"),
+    "year": Bucket(365.25, "Y", "Yearly"),
+}
+
+MAX_CHART_POINTS = config("MAX_CHART_POINTS", default=120, cast=int)
+
+
+def pick_bucket(days, max_points=MAX_CHART_POINTS):
+    """Returns the finest bucket that keeps a days long window within max_points."""
+    for name, bucket in BUCKETS.items():
+        if (days + 1) / bucket.days <= max_points:
+            return name
+    return "year"
@@ -0,0 +1,105 @@
+"""
+Cache of rendered /see_gains charts, so repeated requests skip the database and the
+renderer.
+
+Charts are keyed by a hash of everything that shapes them, including a per-user data
+version that commands changing a user's gains must bump, and the UTC date, since the
+window moves daily. At most CHART_CACHE_SIZE charts are kept in memory; with
+CHART_CACHE_DIR set, charts pushed out of memory are kept there too, up to
+CHART_CACHE_DISK_SIZE files. Versions live in this process only, so the disk tier is
+wiped on start, and nothing is cached when the shards are split across processes, as
+a gain added through another process wouldn't bump the version here.
+"""
+import asyncio
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+import hashlib
+from pathlib import Path
+
+from decouple import config
+
+from gainsworth.sharding import runs_some_shards
+
+
+class ChartCache:
+    def __init__(self, maxsize=256, disk_dir=None, disk_size=2048):
+        self.maxsize = maxsize
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_size = disk_size
+        self.hits = 0
+        self.misses = 0
+        self._versions = defaultdict(int)
+        self._entries = OrderedDict()
+        self._on_disk = OrderedDict()
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for stale in self.disk_dir.glob("*.png"):
+                stale.unlink()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, user_id, days, plot_type, show):
+        """Hashes a chart request, show being the raw activity filter."""
+        shown = sorted({name.strip(", ") for name in show.split(" ")
+                        if name.strip(", ")})
+        parts = (user_id, days, plot_type, tuple(shown), self._versions[user_id],
+                 datetime.utcnow().date().isoformat())
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def bump(self, user_id):
+        """Marks a user's (internal id) charts as stale."""
+        self._versions[user_id] += 1
+
+    async def get(self, key):
+        png = self._entries.get(key)
+        if png is not None:
+            self._entries.move_to_end(key)
+        elif key in self._on_disk:
+            try:
+                png = await asyncio.to_thread(self._on_disk[key].read_bytes)
+            except OSError:
+                self._on_disk.pop(key, None)
+            else:
+                await self.put(key, png)
+        if png is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return png
+
+    async def put(self, key, png):
+        for old_key, old_png in self._remember(key, png):
+            if not self.disk_dir:
+                continue
+            path = self.disk_dir / f"{old_key}.png"
+            await asyncio.to_thread(path.write_bytes, old_png)
+            self._on_disk[old_key] = path
+            self._on_disk.move_to_end(old_key)
+            while len(self._on_disk) > self.disk_size:
+                _, oldest = self._on_disk.popitem(last=False)
+                await asyncio.to_thread(oldest.unlink, missing_ok=True)
+
+    def clear(self):
+        self._entries.clear()
+        for path in self._on_disk.values():
+            path.unlink(missing_ok=True)
+        self._on_disk.clear()
+
+    def _remember(self, key, png):
+        # returns what fell out of memory
+        self._entries[key] = png
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            evicted.append(self._entries.popitem(last=False))
+        return evicted
+
+
+if runs_some_shards():
+    chart_cache = ChartCache(maxsize=0)
+else:
+    chart_cache = ChartCache(
+        maxsize=config("CHART_CACHE_SIZE", default=256, cast=int),
+        disk_dir=config("CHART_CACHE_DIR", default="") or None,
+        disk_size=config("CHART_CACHE_DISK_SIZE", default=2048, cast=int))
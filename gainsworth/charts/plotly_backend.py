@@ -0,0 +1,50 @@
+"""
+High-fidelity chart backend, plotly figures rasterized by kaleido's headless browser.
+"""
+import plotly.express as px
+
+from .buckets import BUCKETS
+
+
+def draw(gains, bucket, plot_type):
+    """Draws gap-filled gains (see render.fill_gaps), one point per bucket, as a PNG."""
+    # see templates: https://plotly.com/python/templates/#theming-and-templates
+    if plot_type in ["hist", "histogram", "h", "his", "hgram"]:
+        fig = px.histogram(gains,
+                           x=gains.index,
+                           y="reps",
+                           color="name",
+                           labels={
+                                   "date": "Date",
+                                   "reps": "No. of Reps",
+                                   "name": "Activities:"
+                                  },
+                           title="GAINS!",
+                           template="plotly_dark+xgridoff",
+                           nbins=gains.index.nunique(),
+                           barmode="group"
+                           )
+    else:
+        fig = px.line(gains,
+                      x=gains.index,
+                      y="reps",
+                      color="name",
+                      labels={
+                              "index": "Date",
+                              "date": "Date",
+                              "reps": f"{BUCKETS[bucket].adjective}"
+                                      " No. of Cumulative Reps",
+                              "name": "Activities:"
+                             },
+                      title="GAINS!",
+                      template="plotly_dark+xgridoff",
+                      )
+        fig.update_traces(mode="markers+lines", marker={"opacity": 0.5})
+    max_val = gains["reps"].max()
+    fig.update_layout(yaxis={"range": [0, max_val + max_val/10]})
+    return fig.to_image(format="png")
+
+
+def warm_up():
+    # the first to_image starts kaleido's browser, which then stays up
+    px.line(x=[0, 1], y=[0, 1], template="plotly_dark+xgridoff").to_image(format="png")
@@ -0,0 +1,121 @@
+"""
+Process pool that renders /see_gains charts away from the event loop.
+
+CHART_WORKERS processes render at once; up to CHART_QUEUE_LIMIT more charts may wait
+for a free worker, after which render raises ChartQueueFull until the queue drains.
+CHART_BACKEND picks the renderer, see backends.py.
+Workers are started and warmed up by start() and live until close(); if one dies the
+pool is replaced and the chart retried once.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import time
+
+from decouple import config
+
+from .backends import BACKENDS
+
+
+def _in_worker(name, *args):
+    # render.py brings pandas and a chart backend along, only worker processes load it
+    from . import render
+    return getattr(render, name)(*args)
+
+
+class ChartQueueFull(Exception):
+    pass
+
+
+class ChartRenderer:
+    def __init__(self, workers=1, queue_limit=8, backend="matplotlib"):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown chart backend {backend!r},"
+                             f" pick one of {', '.join(BACKENDS)}")
+        self.workers = workers
+        self.backend = backend
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.logger = logging.getLogger(__name__)
+        self._executor = self._new_executor()
+        self._restarting = None
+
+    def _new_executor(self):
+        # forking a process that runs an event loop and db threads isn't safe
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    async def start(self):
+        """Starts every worker and has it render a first chart."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            warmed = await asyncio.gather(
+                *[loop.run_in_executor(self._executor, _in_worker, "warm_up",
+                                       self.backend)
+                  for _ in range(self.workers)])
+        except Exception as e:
+            # nobody awaits this, so a missing kaleido or the like only shows up here
+            self.logger.error(f"chart workers failed to warm up {self.backend}:"
+                              f" {e!r}")
+            return
+        for pid, seconds in warmed:
+            self.logger.info(f"chart worker {pid} warmed up {self.backend}"
+                             f" in {seconds:.2f}s")
+        self.logger.info(f"{self.workers} chart workers ready after"
+                         f" {time.perf_counter() - start:.2f}s")
+
+    @property
+    def full(self):
+        """Whether a new chart would be turned away."""
+        return self.in_flight >= self.workers + self.queue_limit
+
+    @property
+    def busy(self):
+        """Whether a new chart would have to wait for a worker."""
+        return self.in_flight >= self.workers
+
+    async def render(self, rows, days, plot_type, bucket="day"):
+        """Renders a chart in a worker process, see render.render_chart."""
+        if self.full:
+            raise ChartQueueFull()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            executor = self._executor
+            args = ("timed_render_chart", rows, days, plot_type, bucket, self.backend)
+            try:
+                png, seconds = await loop.run_in_executor(executor, _in_worker, *args)
+            except BrokenProcessPool:
+                self._restart(executor)
+                png, seconds = await loop.run_in_executor(self._executor, _in_worker,
+                                                          *args)
+            self.logger.info(f"rendered {plot_type} chart of {len(rows)} {bucket} rows"
+                             f" in {seconds:.3f}s"
+                             f" ({time.perf_counter() - start:.3f}s with queueing)")
+            return png
+        finally:
+            self.in_flight -= 1
+
+    def _restart(self, broken):
+        # concurrent renders can all see the same broken pool, only replace it once
+        if broken is not self._executor:
+            return
+        self.logger.error("a chart worker died, restarting the chart workers")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+        self._restarting = asyncio.get_running_loop().create_task(self.start())
+
+    async def close(self):
+        if self._restarting:
+            self._restarting.cancel()
+        await asyncio.to_thread(self._executor.shutdown, cancel_futures=True)
+
+
+def chart_renderer():
+    return ChartRenderer(workers=config("CHART_WORKERS", default=1, cast=int),
+                         queue_limit=config("CHART_QUEUE_LIMIT", default=8, cast=int),
+                         backend=config("CHART_BACKEND", default="matplotlib"))
@@ -0,0 +1,66 @@
+"""
+Chart rendering for /see_gains. Runs inside the chart worker processes (see pool.py),
+so everything here takes and returns plain data: no sessions, no discord objects.
+"""
+from datetime import datetime, timedelta
+import importlib
+import os
+import time
+
+import pandas as pd
+
+from .backends import BACKENDS
+from .buckets import BUCKETS
+
+
+def _backend(name):
+    return importlib.import_module(BACKENDS[name])
+
+
+def fill_gaps(gains, start_day, end_day, period="D"):
+    """
+    Sums (date, name, reps) gains per bucket and activity, with a zero for every bucket
+    in [start_day, end_day] an activity has no gains in. Buckets are pandas periods,
+    days by default. Returns them indexed by each bucket's first day.
+    """
+    days = pd.period_range(start=start_day, end=end_day, freq=period) \
+             .to_timestamp().rename("date")
+    names = pd.Index(gains["name"].unique(), name="name")
+    totals = gains.assign(date=gains["date"].dt.to_period(period).dt.start_time) \
+                  .groupby(["date", "name"], observed=True)["reps"].sum()
+    full = pd.MultiIndex.from_product([days, names])
+    return totals.reindex(full, fill_value=0.0).reset_index(level="name")
+
+
+def render_chart(rows, days, plot_type, bucket="day", backend="matplotlib"):
+    """
+    Draws a user's gains as a PNG and returns its bytes.
+    rows are the (date, name, reps) tuples crud.daily_gains returns for the window and
+    bucket (see buckets.py), with reps as floats, backend one of BACKENDS.
+    """
+    exercises = pd.DataFrame.from_records(rows, columns=["date", "name", "reps"])
+    exercises = exercises.astype({"date": "datetime64[ns]",
+                                  "name": "category",
+                                  "reps": "float64"})
+    start_day = pd.Timestamp((datetime.utcnow() - timedelta(days=days)).date())
+    subset_exc = fill_gaps(exercises, start_day, pd.Timestamp(datetime.utcnow().date()),
+                           BUCKETS[bucket].period)
+    return _backend(backend).draw(subset_exc, bucket, plot_type)
+
+
+def warm_up(backend="matplotlib"):
+    """
+    Renders a throwaway chart so this worker has pandas and the backend (for plotly,
+    kaleido's browser too) loaded before a real request arrives.
+    Returns (pid, seconds taken).
+    """
+    start = time.perf_counter()
+    _backend(backend).warm_up()
+    return os.getpid(), time.perf_counter() - start
+
+
+def timed_render_chart(*args):
+    """render_chart, returning (png, seconds spent rendering)."""
+    start = time.perf_counter()
+    png = render_chart(*args)
+    return png, time.perf_counter() - start
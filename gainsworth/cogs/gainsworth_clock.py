@@ -1,10 +1,11 @@
-from datetime import date, timedelta
+from datetime import datetime, timedelta
 import json
 import logging
 from os.path import exists
 import pathlib
 import re
 import sys
+import time
 
 from decouple import config
 import discord
@@ -12,20 +13,31 @@ from discord.ext import commands, tasks
 from discord.ext.commands import Context
 from sqlalchemy.sql import func
 
-from sqlalchemy import create_engine, func, update
-from sqlalchemy.orm import sessionmaker
+from gainsworth.db import crud
+from gainsworth.db.cache import identity_cache
+from gainsworth.metrics import timed
+from gainsworth.sharding import runs_global_jobs
 
-from gainsworth.db.models import Exercise, User
 
+REMOVAL_WEEKS = config("INACTIVE_REMOVAL_WEEKS", default=52, cast=int)
+REMOVAL_BATCH_SIZE = config("INACTIVE_REMOVAL_BATCH_SIZE", default=5000, cast=int)
+# months of raw exercise rows kept hot, older months are archived (0 turns this off)
+ARCHIVE_AFTER_MONTHS = config("EXERCISE_ARCHIVE_MONTHS", default=24, cast=int)
 
-url = config("DATABASE_URL")
-if url:
-    if "postgresql" not in url:
-        url = url.replace("postgres", "postgresql")
-engine = create_engine(url)
-Session = sessionmaker(bind=engine)
 
-DEFAULT_REMOVAL=date.today() - timedelta(weeks=52)
+def removal_cutoff():
+    """Users idle since before midnight (UTC) of this day are removed."""
+    cutoff = datetime.utcnow().date() - timedelta(weeks=REMOVAL_WEEKS)
+    return datetime.combine(cutoff, datetime.min.time())
+
+
+def archive_cutoff():
+    """First day of the oldest month whose exercise rows stay in the hot table."""
+    month = datetime.utcnow().date().replace(day=1)
+    for _ in range(ARCHIVE_AFTER_MONTHS):
+        month = (month - timedelta(days=1)).replace(day=1)
+    return month
+
 
 class GainsClock(commands.Cog):
     def __init__(self, client):
@@ -36,6 +48,7 @@ class GainsClock(commands.Cog):
         self.client = client
         self._last_member = None
         self.remove_inactive.start()
+        self.archive_cold_data.start()
         self.logger = logging.getLogger(__name__)
 
         self.logger.info('Gainsworth Cog instance created')
@@ -50,35 +63,77 @@ class GainsClock(commands.Cog):
         print("Gainsworth's clock is ticking...")
 
     @tasks.loop(hours=24.0)
+    @timed
     async def remove_inactive(self):
-        removed = []
-        memory = self.client.get_cog("GainsMemory")
-        ses = Session()
-        users = ses.query(User).all()
-        for user in users:
-            if not user:
-                continue
-            # checking for null value
-            if not user.last_active:
-                user.last_active = func.now()
-                ses.commit()
-            if user.auto_remove and user.last_active.date() < DEFAULT_REMOVAL:
-                try:
-                    removed.append(user.user_id)
-                    target = ses.query(User).filter(User.user_id == user.user_id).delete()
-                    ses.commit()
-                except Exception as e:
-                    self.logger.error(f"Failed to remove user; {e}")
+        if not runs_global_jobs(self.client):
+            return
+        started = time.perf_counter()
+        cutoff = removal_cutoff()
+        removed = 0
+        backfilled = 0
+        ses = crud.get_session()
+        try:
+            # checking for null values
+            backfilled = await crud.backfill_last_active(ses)
+            await ses.commit()
+            # delete in batches so no single statement holds locks for long
+            while batch := await crud.inactive_users(ses, cutoff, REMOVAL_BATCH_SIZE):
+                removed += await crud.delete_users(ses, [user.id for user in batch])
+                await ses.commit()
+                for user in batch:
+                    identity_cache.invalidate(user.user_id)
+        except Exception as e:
+            await ses.rollback()
+            self.logger.error(f"Failed to remove inactive users; {e}")
+        finally:
+            await ses.close()
         #TODO: make sure this loop runs again on DC, and after init
         print("Inactive check completed")
-        ses.close()
-        self.logger.info("list of IDs removed: {removed}")
+        self.logger.info(f"removed {removed} users inactive since {cutoff.date()} in"
+                         f" {time.perf_counter() - started:.2f}s"
+                         f" ({backfilled} missing last_active values filled)")
 
     @remove_inactive.before_loop
     async def before_remove_inactive(self):
         print("waiting...")
         await self.client.wait_until_ready()
 
+    @tasks.loop(hours=24.0)
+    async def archive_cold_data(self):
+        if not runs_global_jobs(self.client):
+            return
+        started = time.perf_counter()
+        cutoff = archive_cutoff()
+        archived = 0
+        created = []
+        ses = crud.get_session()
+        try:
+            created = await crud.ensure_exercise_partitions(ses)
+            await ses.commit()
+            while ARCHIVE_AFTER_MONTHS:
+                month = await crud.oldest_exercise_month(ses)
+                if month is None or month >= cutoff:
+                    break
+                archived += await crud.archive_exercise_month(ses, month)
+                await ses.commit()
+                self.logger.info(f"archived exercises from {month:%Y-%m}")
+            if ARCHIVE_AFTER_MONTHS:
+                # months that never had any rows still have an (empty) partition
+                await crud.drop_exercise_partitions_before(ses, cutoff)
+                await ses.commit()
+        except Exception as e:
+            await ses.rollback()
+            self.logger.error(f"Failed to archive old exercises; {e}")
+        finally:
+            await ses.close()
+        self.logger.info(f"created partitions {created}, archived {archived} exercise"
+                         f" rows older than {cutoff}"
+                         f" in {time.perf_counter() - started:.2f}s")
+
+    @archive_cold_data.before_loop
+    async def before_archive_cold_data(self):
+        await self.client.wait_until_ready()
+
 
 async def setup(client):
     """
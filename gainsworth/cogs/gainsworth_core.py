@@ -1,16 +1,43 @@
+import asyncio
+from collections import Counter
 import json
 import logging
 from os.path import exists
 import pathlib
 import re
 import sys
+import time
 import discord
+from decouple import config
 from discord import app_commands
 from discord.ext import commands
 
 from discord.ext.commands import Context, Greedy
 from typing import Literal, Optional
 
+from gainsworth.command_sync import sync_if_changed
+from gainsworth.db import crud
+
+# discord.py waits out rate limits itself, this only caps how many guilds are in flight
+BROADCAST_CONCURRENCY = config("BROADCAST_CONCURRENCY", default=5, cast=int)
+UNSUBSCRIBE = ("If you'd like to stop receiving this changelog, please create an issue"
+               " on my `/github`")
+
+
+def broadcast_channel(guild):
+    """
+    Picks the channel a broadcast goes to from the cached permissions: the system
+    channel, else the topmost text channel Gainsworth may speak in. None if there's
+    none.
+    """
+    for channel in [guild.system_channel, *guild.text_channels]:
+        if channel is None:
+            continue
+        permissions = channel.permissions_for(guild.me)
+        if permissions.view_channel and permissions.send_messages:
+            return channel
+    return None
+
 
 class Gainsworth(commands.Cog):
     def __init__(self, client):
@@ -22,6 +49,7 @@ class Gainsworth(commands.Cog):
             self.version = json.load(conf)["version"]
         self.client = client
         self._last_member = None
+        self._broadcast = None
         self.logger = logging.getLogger(__name__)
         self.logger.info('Gainsworth Cog instance created')
 
@@ -50,27 +78,87 @@ class Gainsworth(commands.Cog):
         version = text.split("\n")[0].split(" ")[1]
         return version, text
 
-    async def broadcast_changelog(self, text, filter_name=None):
+    async def broadcast_changelog(self, text, filter_name=None, version=None):
         """
         Broadcast most recent changes to all servers in the first channel that
         Gainsworth has permission to speak in, across all servers.
+        When sharded, each process only sees (and so only sends to) its own shards'
+        guilds.
+        Every guild's outcome is stored per version, so running it again only sends
+        to the guilds that haven't had it yet. Returns whether every send went through.
         """
+        version = version or self.version
         if filter_name:
             guilds = [x for x in self.client.guilds if x.name==filter_name]
         else:
             guilds = self.client.guilds
+        ses = crud.get_session()
+        try:
+            done = await crud.delivered_guilds(ses, version)
+        finally:
+            await ses.close()
+        pending = asyncio.Queue()
         for guild in guilds:
-            for channel in guild.channels:
+            if guild.id not in done:
+                pending.put_nowait(guild)
+        self.logger.info(f"broadcasting changelog {version} to {pending.qsize()}"
+                         f" guilds, {len(done)} already had it")
+        counts = Counter()
+        start = time.perf_counter()
+
+        async def worker():
+            while not pending.empty():
+                guild = pending.get_nowait()
+                counts[await self._deliver(guild, text, version)] += 1
+                if sum(counts.values()) % 100 == 0:
+                    self.logger.info(f"broadcast progress: {dict(counts)}")
+
+        await asyncio.gather(*[worker() for _ in range(BROADCAST_CONCURRENCY)])
+        self.logger.info(f"broadcast of {version} finished in"
+                         f" {time.perf_counter() - start:.1f}s: {dict(counts)}")
+        return not counts["failed"]
+
+    async def _deliver(self, guild, text, version):
+        # failures aren't recorded, so the next broadcast retries the guild; nothing may
+        # escape, a worker that raised would stop the broadcast with the others running
+        try:
+            channel = broadcast_channel(guild)
+            status = "no_channel"
+            if channel:
                 try:
-                    await channel.send(text)
-                    await channel.send("If you'd like to stop receiving this changelog, please create an issue on my `/github`") 
+                    if len(text) + len(UNSUBSCRIBE) < 2000:
+                        await channel.send(f"{text}\n{UNSUBSCRIBE}")
+                    else:
+                        await channel.send(text)
+                        await channel.send(UNSUBSCRIBE)
+                    status = "sent"
                     print(f"changelog sent to {guild.name}: {channel.name}")
-                    break
-                except Exception:
-                    continue
-                else:
-                    break
-        return True
+                except discord.Forbidden:
+                    status = "forbidden"
+            ses = crud.get_session()
+            try:
+                await crud.record_delivery(ses, version, guild.id,
+                                           channel and channel.id, status)
+                await ses.commit()
+            finally:
+                await ses.close()
+            return status
+        except Exception as e:
+            self.logger.warning(f"changelog not delivered to {guild.id}: {e!r}")
+            return "failed"
+
+    async def _release(self, version, text):
+        if await self.broadcast_changelog(text, version=version):
+            self._save_version(version)
+
+    def _save_version(self, version):
+        self.version = version
+        # update config with version
+        with open(pathlib.Path("gainsworth", "cfg", "gains_config.json"), "r") as conf:
+            config = json.load(conf)
+            config['version'] = self.version
+        with open(pathlib.Path("gainsworth", "cfg", "gains_config.json"), "w") as conf:
+            json.dump(config, conf)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -83,18 +171,15 @@ class Gainsworth(commands.Cog):
         print(f"Gainsworth is in {len(self.client.guilds)} guilds!")
         version, text = await self.check_changelog()
         if self.version != version:
-            self.version = version
-            # update config with version
-            with open(pathlib.Path("gainsworth", "cfg", "gains_config.json"), "r") as conf:
-                config = json.load(conf)
-                conf_version = config['version']
-                config['version'] = self.version
-            with open(pathlib.Path("gainsworth", "cfg", "gains_config.json"), "w") as conf:
-                json.dump(config, conf)
-                # checking for semi-major version changes
-            if version.split(".")[1] != conf_version.split(".")[1]:
-                # broadcast changes
-                await self.broadcast_changelog(text)
+            # checking for semi-major version changes
+            if version.split(".")[1] != self.version.split(".")[1]:
+                # broadcast changes; the version is saved once every guild has them,
+                # so an interrupted broadcast resumes on the next start. on_ready fires
+                # again on reconnects, hence the check for one already running.
+                if self._broadcast is None or self._broadcast.done():
+                    self._broadcast = asyncio.create_task(self._release(version, text))
+            else:
+                self._save_version(version)
 
 
     @commands.Cog.listener()
@@ -136,12 +221,19 @@ class Gainsworth(commands.Cog):
 
     @commands.command(aliases=["sync"])
     @commands.is_owner() #will raise an error if the person who executed the command is not the owner of the bot
-    async def sync_command(self, ctx):
+    async def sync_command(self, ctx, force: Optional[Literal["force"]] = None):
+        """
+        Syncs the slash commands with Discord, if they changed since the last sync.
+        Add "force" to sync regardless.
+        """
         # self.client.tree.copy_global_to(guild = discord.Object(id=740310401001980036))
         # If testing remember to put the testing guild in the below sync
-        await self.client.tree.sync()
-        await ctx.reply("Synced!")
-        print("Synced!")
+        if await sync_if_changed(self.client.tree, force=bool(force)):
+            await ctx.reply("Synced!")
+            print("Synced!")
+        else:
+            await ctx.reply("The commands haven't changed since the last sync, so I"
+                            " skipped it. Use `sync force` to sync anyway.")
 
 
     @app_commands.command()
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 import logging
 
 import discord
@@ -7,18 +7,15 @@ import discord
 from decouple import config
 from discord import app_commands
 from discord.ext import commands
-from sqlalchemy import create_engine, func, update
-from sqlalchemy.orm import sessionmaker
 
-from gainsworth.db.models import Exercise, User
+from gainsworth.charts.cache import chart_cache
+from gainsworth.db import crud
+from gainsworth.db.buffer import GainBuffer
+from gainsworth.db.cache import identity_cache
+from gainsworth.metrics import metrics, timed
 
-
-url = config("DATABASE_URL")
-if url:
-    if "postgresql" not in url:
-        url = url.replace("postgres", "postgresql")
-engine = create_engine(url)
-Session = sessionmaker(bind=engine)
+# Off by default: with it on, /add_gains answers before its gains reach the database.
+WRITE_BEHIND = config("WRITE_BEHIND", default=False, cast=bool)
 
 
 class GainsMemory(commands.Cog):
@@ -29,9 +26,29 @@ class GainsMemory(commands.Cog):
         """
         self.client = client
         self._last_member = None
+        self.buffer = None
         self.logger = logging.getLogger(__name__)
         self.logger.info('GainsMemory Cog instance created')
 
+    async def cog_load(self):
+        if WRITE_BEHIND:
+            self.buffer = GainBuffer(
+                config("WRITE_BEHIND_JOURNAL", default="gainsworth_gains.journal"),
+                batch_size=config("WRITE_BEHIND_BATCH_SIZE", default=500, cast=int),
+                interval=config("WRITE_BEHIND_INTERVAL", default=2.0, cast=float))
+            self.buffer.on_flush.append(self._gains_changed)
+            await self.buffer.start()
+        metrics.gauge("identity_cache_hits_total",
+                      "Registration lookups answered from memory.",
+                      lambda: identity_cache.hits, "counter")
+        metrics.gauge("identity_cache_misses_total",
+                      "Registration lookups that went to the database.",
+                      lambda: identity_cache.misses, "counter")
+
+    async def cog_unload(self):
+        if self.buffer:
+            await self.buffer.stop()
+
     @commands.Cog.listener()
     async def on_ready(self):
         """
@@ -45,51 +62,41 @@ class GainsMemory(commands.Cog):
         user_name = f"{interaction.user.name}#{interaction.user.discriminator}"
         if interaction.user == self.client.user:
             return
-        ses = Session()
-        registered_id = None
+        ses = crud.get_session()
+        registered_id = identity_cache.get(interaction.user.id)
+        # a changed username falls through to register_user, which renames the row
+        if registered_id and registered_id.name == user_name:
+            return ses, registered_id
         try: 
-            user_id = interaction.user.id
-            registered_id = ses.query(User).filter(User.user_id == user_id).first()
-            if not registered_id:
-                registered_username = ses.query(User).filter(User.name == user_name).first()
-                if not registered_username:
-                    name = User(name=user_name,
-                                user_id=user_id,
-                                date_created=datetime.utcnow(),
-                                last_active=datetime.utcnow())
-                    ses.add(name)
-                    ses.commit()
-                if not registered_username.user_id:
-                    registered_username.user_id = user_id
-                    ses.commit()
-                registered_id = ses.query(User).filter(User.user_id == user_id).first()
-            if registered_id.name != user_name:
-                registered_id.name = user_name
-                ses.commit()
+            registered_id = await crud.register_user(ses, interaction.user.id,
+                                                     user_name)
+            registered_id = identity_cache.put(registered_id)
         except Exception as e:
             self.logger.error(f"failed user lookup or registration: {e}")
         # add logic for updating username checking registered_id AND registered_username == current_username
         return ses, registered_id
 
-    async def _add_gain(self, ses, user, amt, exercise):
-        unit = ses.query(Exercise).filter(Exercise.user_id == user.id) \
-               .filter(Exercise.name == exercise).first().unit
-        gain = Exercise(name=exercise,
-                        reps=Decimal(amt),
-                        unit=unit,
-                        date=datetime.utcnow(),
-                        user_id=user.id)
-        ses.add(gain)
-        self.logger.info(f"New gain added: {gain}")
-        user.last_active = datetime.utcnow()
-        ses.commit()
-        return ses, unit
+    def _gains_changed(self, gains):
+        for user_id in {gain["user_id"] for gain in gains}:
+            chart_cache.bump(user_id)
+
+    async def _add_gains(self, ses, gains):
+        if self.buffer:
+            await self.buffer.put(gains)
+            self.logger.info(f"New gains queued: {gains}")
+            return ses
+        await crud.record_gains(ses, gains)
+        await ses.commit()
+        self._gains_changed(gains)
+        self.logger.info(f"New gains added: {gains}")
+        return ses
 
 
     @app_commands.describe(
         exercises="Currently add this like: exercise_name1 100 exercise_name2 50",
     )
     @app_commands.command()
+    @timed
     async def add_gains(self, interaction: discord.Interaction, exercises: str) -> None:
         """
         Tell Gainsworth about an activity that you did!
@@ -103,13 +110,21 @@ class GainsMemory(commands.Cog):
         Or if you'd like to remove an erroneous entry:\n
         /add_gains -10 Pushups\n
         """
-        ses, user = await self._check_registered(interaction)
-        args = exercises.split(" ")
-        if len(args) % 2:
-            raise commands.ArgumentParsingError()
-        arg_pairs = [(args[ii], args[ii+1]) for ii in range(0, len(args)-1, 2)]
-        if user:
-            exercises = [e.name for e in user.exercises]
+        with metrics.phase("register"):
+            ses, user = await self._check_registered(interaction)
+        # closing rolls back whatever a failed write left behind
+        try:
+            args = exercises.split(" ")
+            if len(args) % 2:
+                raise commands.ArgumentParsingError()
+            arg_pairs = [(args[ii], args[ii+1]) for ii in range(0, len(args)-1, 2)]
+            if not user:
+                return
+            # validate the whole message before writing anything
+            with metrics.phase("db"):
+                exercises = await crud.user_activities(ses, user.id)
+            now = datetime.utcnow()
+            gains = []
             msgs = []
             for pair in arg_pairs:
                 amount, exercise = pair
@@ -117,8 +132,24 @@ class GainsMemory(commands.Cog):
                 exercise = exercise.strip(",;. ")
                 if exercise[-1].isdigit() and any([c.isalpha() for c in amount]):
                     exercise, amount = amount, exercise
+                try:
+                    reps = Decimal(amount)
+                except InvalidOperation:
+                    reps = None
+                # NaN, infinities and amounts the reps columns can't hold are refused
+                if reps is None or not crud.valid_reps(reps):
+                    await interaction.response.send_message(
+                        f"I couldn't read {amount} as an amount of {exercise},"
+                        f" {interaction.user.name}! Amounts should be numbers, like"
+                        " `/add_gains 10 Pushups`.")
+                    return
                 if exercise in exercises:
-                    ses, unit = await self._add_gain(ses, user, amount, exercise)
+                    activity = exercises[exercise]
+                    gains.append({"user_id": user.id,
+                                  "activity_id": activity.id,
+                                  "reps": reps,
+                                  "date": now})
+                    unit = activity.unit
                     # Some string formatting handling
                     unit_handler = ""
                     if unit:
@@ -131,17 +162,17 @@ class GainsMemory(commands.Cog):
                     await interaction.response.send_message(f"I didn't find that activity, {exercise}, in your"
                                    f" list, {interaction.user.name}! Type `/list_activities`"
                                    " to see all the activities I'm currently tracking.")
-                    ses.close()
                     return
-            msgs = "\n".join(msgs)
-            ses.close()
-            await interaction.response.send_message(f"{interaction.user.name}, I've recorded the following activity:"
-                           f"\n{msgs}\nAwesome work! Try typing"
-                           " `/list_gains` or `/see_gains` to see the totals"
-                           " of your activities!")
-        else:
-            ses.close()
-            return
+            with metrics.phase("db"):
+                await self._add_gains(ses, gains)
+        finally:
+            await ses.close()
+        msgs = "\n".join(msgs)
+        with metrics.phase("send"):
+            await interaction.response.send_message(
+                f"{interaction.user.name}, I've recorded the following activity:"
+                f"\n{msgs}\nAwesome work! Try typing `/list_gains` or `/see_gains`"
+                " to see the totals of your activities!")
 
     @app_commands.describe(
         name="The name of your exercise, probably use plural.",
@@ -166,27 +197,22 @@ class GainsMemory(commands.Cog):
         """
         ses, user = await self._check_registered(interaction)
         if user:
-            if ses.query(Exercise).filter(Exercise.user_id == user.id) \
-               .filter(Exercise.name == name).first():
+            if await crud.get_activity(ses, user.id, name):
+                await ses.close()
                 await interaction.response.send_message(f'That activity already exists for you,'
                                f' {interaction.user.name}! Type `/list_activities` to see all'
                                ' the activities you have already added.')
             else:
-                exercise = Exercise(name=name,
-                                    reps=0,
-                                    unit=unit,
-                                    date=datetime.utcnow(),
-                                    user_id=user.id)
-                ses.add(exercise)
-                self.logger.info(f"New type of activity created: {exercise}")
-                ses.commit()
-                ses.close()
+                activity = await crud.create_activity(ses, user.id, name, unit)
+                self.logger.info(f"New type of activity created: {activity}")
+                await ses.commit()
+                await ses.close()
                 await interaction.response.send_message(f"{interaction.user.name}, your activity has been created! You"
                                " can now keep track of your daily gains with the"
                                " `/add_gains` command."
                                f" Example: /add_gains 10 {name}.")
         else:
-            ses.close()
+            await ses.close()
             return
 
     @app_commands.command()
@@ -196,10 +222,9 @@ class GainsMemory(commands.Cog):
         """
         ses, user = await self._check_registered(interaction)
         if user:
-            exercises = [(e.name, e.unit) for e in user.exercises]
-            exercises = set(exercises)
+            exercises = await crud.list_activities(ses, user.id)
             if len(exercises) < 1:
-                ses.close()
+                await ses.close()
                 await interaction.response.send_message(f"{interaction.user.name}, it looks like you haven't created"
                                " any activities! Type `/help create_activity` to get"
                                " started!")
@@ -211,11 +236,11 @@ class GainsMemory(commands.Cog):
                     else:
                         formatted_exercises.append(f"{tup[0]}")
                 formatted_exercises = "\n".join(formatted_exercises)
-                ses.close()
+                await ses.close()
                 await interaction.response.send_message(f"{interaction.user.name}, here is a list of your activities!\n"
                                f"{formatted_exercises}")
         else:
-            ses.close()
+            await ses.close()
             return
 
 
@@ -223,6 +248,7 @@ class GainsMemory(commands.Cog):
         days="The number of days in the past you want to list your gains from, defaults to 7",
     )
     @app_commands.command()
+    @timed
     async def list_gains(self, interaction: discord.Interaction, days: int=7) -> None:
         """
         List the Gains you've made in the past X days!
@@ -237,12 +263,15 @@ class GainsMemory(commands.Cog):
         All gains since you began tracking gains are listed by default,
         or if there is an erroneous time filter.
         """
-        await interaction.response.defer(thinking=True)
-        ses, user = await self._check_registered(interaction)
+        with metrics.phase("send"):
+            await interaction.response.defer(thinking=True)
+        with metrics.phase("register"):
+            ses, user = await self._check_registered(interaction)
         if user:
-            exercise_objs = [e for e in user.exercises]
-            if len(exercise_objs) < 1:
-                ses.close()
+            with metrics.phase("db"):
+                has_activities = await crud.has_activities(ses, user.id)
+            if not has_activities:
+                await ses.close()
                 await interaction.response.send_message(f"{interaction.user.name}, it looks like you haven't created"
                                " any activities! Type `/help create_activity` to get"
                                " started!")
@@ -258,12 +287,8 @@ class GainsMemory(commands.Cog):
                             await interaction.followup.send("There was a problem with your days, please input a whole number!")
                 end = datetime.utcnow()
                 start = (end-timedelta(days=days))
-                result = [x for x in ses.query(Exercise.name,
-                                            Exercise.unit,
-                                            func.sum(Exercise.reps))
-                        .filter(Exercise.user_id == user.id)
-                        .filter(Exercise.date >= start)
-                        .group_by(Exercise.name, Exercise.unit).all()]
+                with metrics.phase("db"):
+                    result = await crud.sum_gains(ses, user.id, start)
 
                 for name, unit, reps in result:
                     if unit:
@@ -272,12 +297,14 @@ class GainsMemory(commands.Cog):
                         totals.append(f"{reps} {name}")
                 msg = f"Since {start.date()}, you've done a total of:\n"
                 msg += "\n".join(totals)
-                ses.close()
-                await interaction.followup.send(f"{interaction.user.name}, here is a list of your totals!\n"
-                               f"{msg}\nKeep up the **great gains** you're making!")
+                await ses.close()
+                with metrics.phase("send"):
+                    await interaction.followup.send(
+                        f"{interaction.user.name}, here is a list of your totals!\n"
+                        f"{msg}\nKeep up the **great gains** you're making!")
 
         else:
-            ses.close()
+            await ses.close()
             return
 
     @app_commands.describe(
@@ -295,22 +322,19 @@ class GainsMemory(commands.Cog):
         await interaction.response.defer(thinking=True)
         ses, user = await self._check_registered(interaction)
         if user:
-            remove_target = ses.query(Exercise).filter(Exercise.user_id == user.id) \
-                            .filter(Exercise.name == exercise).delete()
+            remove_target = await crud.delete_activity(ses, user.id, exercise)
             self.logger.info(f"records deleted: {remove_target}")
-            # minus the Exercise made by create_activity 
-            total_removed = int(str(remove_target)) - 1
-            if total_removed < 0:
-                total_removed = 0
-            ses.commit()
-            ses.close()
+            total_removed = remove_target
+            await ses.commit()
+            chart_cache.bump(user.id)
+            await ses.close()
             await interaction.followup.send(f"{interaction.user.name}, your **{total_removed}** activity"
                            f" records of **{exercise}** were deleted. You can type"
                            " `!list_activities` to see which activities I'm keeping"
                            " track of, or `!help create_activity` to see how you"
                            " start tracking a new one!")
         else:
-            ses.close()
+            await ses.close()
             return
 
     @app_commands.command()
@@ -323,16 +347,18 @@ class GainsMemory(commands.Cog):
         await interaction.response.defer(thinking=True)
         ses, user = await self._check_registered(interaction)
         if user:
-            remove_target = ses.query(User).filter(User.id == user.id).delete()
+            remove_target = await crud.delete_user(ses, user.id)
+            identity_cache.invalidate(interaction.user.id)
             self.logger.info(f"records deleted: {remove_target}")
-            ses.commit()
-            ses.close()
+            await ses.commit()
+            chart_cache.bump(user.id)
+            await ses.close()
             await interaction.followup.send(f"{interaction.user.name}, all records of your activity was"
                            f" removed from my database. If you'd like to start again,"
                            " type `/help create_activity` to get started."
                            )
         else:
-            ses.close()
+            await ses.close()
             return
 
     @app_commands.command()
@@ -342,19 +368,36 @@ class GainsMemory(commands.Cog):
         """
         ses, user = await self._check_registered(interaction)
         if user:
-            change_target = ses.query(User).filter(User.id == user.id).first()
-            change_target.auto_remove = False
-            self.logger.info(f"auto-remove flag for {change_target} removed")
-            ses.commit()
-            ses.close()
+            change_target = await crud.set_auto_remove(ses, user.id, False)
+            identity_cache.invalidate(interaction.user.id)
+            self.logger.info(f"auto-remove flag for {change_target.name} removed")
+            await ses.commit()
+            await ses.close()
             await interaction.response.send_message(f"{interaction.user.name}, your acitivity data will now be saved"
                            f" until you choose to manually remove it with the"
                            " `/remove_me_please` command."
                            )
         else:
-            ses.close()
+            await ses.close()
             await interaction.response.send_message("It appears you aren't using Gainsworth yet!")
             return
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def backfill_rollups(self, ctx):
+        """
+        Rebuilds the daily gains rollup that /list_gains and /see_gains read from,
+        using the full exercise log. The rollup migration fills it already, this is
+        for repairing it.
+        """
+        ses = crud.get_session()
+        total = await crud.rebuild_daily_gains(ses)
+        await ses.commit()
+        await ses.close()
+        chart_cache.clear()
+        self.logger.info(f"daily gains rollup rebuilt with {total} rows")
+        await ctx.reply(f"Rebuilt {total} daily gain totals!")
+
     # @app_commands.command(name="memhello")
     # async def memhello(self, interaction: discord.Interaction) -> None:
     #     await interaction.response.send_message("Hellooooooooo")
@@ -0,0 +1,70 @@
+from collections import Counter, defaultdict
+import logging
+
+import discord
+from discord.ext import commands
+
+
+class GainsShards(commands.Cog):
+    def __init__(self, client):
+        """
+        The init function will always take a client, which represents
+         the particular bot that is using the cog.
+        """
+        self.client = client
+        # shard id -> event name -> count, unsharded bots count everything under shard 0
+        self.events = defaultdict(Counter)
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('GainsShards Cog instance created')
+
+    def latencies(self):
+        """(shard id, seconds) for every shard this process runs."""
+        if hasattr(self.client, "latencies"):
+            return self.client.latencies
+        return [(self.client.shard_id or 0, self.client.latency)]
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        # direct messages always arrive on shard 0
+        shard_id = interaction.guild.shard_id if interaction.guild else 0
+        self.events[shard_id]["interactions"] += 1
+
+    @commands.Cog.listener()
+    async def on_shard_connect(self, shard_id):
+        self.events[shard_id]["connects"] += 1
+        self.logger.info(f"shard {shard_id} connected")
+
+    @commands.Cog.listener()
+    async def on_shard_disconnect(self, shard_id):
+        self.events[shard_id]["disconnects"] += 1
+        self.logger.warning(f"shard {shard_id} disconnected")
+
+    @commands.Cog.listener()
+    async def on_shard_resumed(self, shard_id):
+        self.events[shard_id]["resumes"] += 1
+        self.logger.info(f"shard {shard_id} resumed")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def shards(self, ctx):
+        """
+        Lists the latency, guild count and event counts of every shard this process
+        runs.
+        """
+        guilds = Counter(guild.shard_id for guild in self.client.guilds)
+        lines = []
+        for shard_id, latency in self.latencies():
+            events = ", ".join(f"{count} {name}" for name, count in
+                               sorted(self.events[shard_id].items())) or "no events"
+            lines.append(f"shard {shard_id}: {latency * 1000:.0f} ms,"
+                         f" {guilds[shard_id]} guilds, {events}")
+        await ctx.reply("\n".join(lines) or "No shards have connected yet.")
+
+
+async def setup(client):
+    """
+    This setup function must exist in every cog file and will ultimately have a
+    nearly identical signature and logic to what you're seeing here.
+    It's ultimately what loads the Cog into the bot.
+    """
+    await client.add_cog(GainsShards(client))
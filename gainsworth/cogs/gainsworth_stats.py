@@ -0,0 +1,88 @@
+import logging
+
+from aiohttp import web
+from decouple import config
+from discord.ext import commands
+
+from gainsworth.db.profiling import slowest_sites
+from gainsworth.metrics import metrics
+
+# Off by default; each process of a sharded bot needs a port of its own.
+METRICS_PORT = config("METRICS_PORT", default=0, cast=int)
+METRICS_HOST = config("METRICS_HOST", default="127.0.0.1")
+PHASES = ("register", "db", "render", "send")
+
+
+class GainsStats(commands.Cog):
+    def __init__(self, client):
+        """
+        The init function will always take a client, which represents
+         the particular bot that is using the cog.
+        """
+        self.client = client
+        self._runner = None
+        self.logger = logging.getLogger(__name__)
+        self.logger.info('GainsStats Cog instance created')
+
+    async def cog_load(self):
+        if METRICS_PORT:
+            app = web.Application()
+            app.router.add_get("/metrics", self._serve_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, METRICS_HOST, METRICS_PORT).start()
+            self.logger.info(f"serving metrics on"
+                             f" http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    async def cog_unload(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _serve_metrics(self, request):
+        return web.Response(text=metrics.prometheus(), headers={
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def summary(self):
+        """
+        One line per command: runs, latency percentiles, mean phase times and queries.
+        """
+        header = (f"{'command':<16}{'runs':>6}{'p50':>8}{'p95':>8}"
+                  + "".join(f"{phase:>10}" for phase in PHASES) + f"{'queries':>9}")
+        lines = [header]
+        commands_run = sorted({command for command, _ in metrics.latency})
+        for command in commands_run:
+            total = metrics.latency[command, "total"]
+            phases = "".join(
+                f"{metrics.latency[command, phase].sum / total.count * 1000:>8.0f}ms"
+                if (command, phase) in metrics.latency else f"{'-':>10}"
+                for phase in PHASES)
+            lines.append(f"{command:<16}{total.count:>6}"
+                         f"{total.quantile(0.5) * 1000:>6.0f}ms"
+                         f"{total.quantile(0.95) * 1000:>6.0f}ms{phases}"
+                         f"{metrics.queries[command] / total.count:>9.1f}")
+        lines.append("")
+        lines += [f"{name}: {value}"
+                  for name, value in sorted(metrics.gauges().items())]
+        lines += ["", "slowest call sites:"]
+        lines += [f"{seconds * 1000:.0f} ms in {statements} statements, {site}"
+                  for site, statements, seconds in slowest_sites()]
+        return "\n".join(lines)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """
+        Shows per command latency (percentiles are bucket bounds), mean time per phase,
+        database statements per run, cache hits, the chart queue and the code spending
+        the most time in the database.
+        """
+        await ctx.reply(f"```\n{self.summary()}\n```")
+
+
+async def setup(client):
+    """
+    This setup function must exist in every cog file and will ultimately have a
+    nearly identical signature and logic to what you're seeing here.
+    It's ultimately what loads the Cog into the bot.
+    """
+    await client.add_cog(GainsStats(client))
@@ -1,15 +1,18 @@
+import asyncio
 from datetime import datetime, timedelta
 import logging
 import io
-from typing import List, Literal
+from typing import Literal
 
 import discord
 from discord import app_commands
 from discord.ext import commands
-import pandas as pd
-import plotly.express as px
 
-from gainsworth.db.models import Exercise
+from gainsworth.charts.buckets import pick_bucket
+from gainsworth.charts.cache import chart_cache
+from gainsworth.charts.pool import ChartQueueFull, chart_renderer
+from gainsworth.db import crud
+from gainsworth.metrics import metrics, timed
 
 
 class GainsVision(commands.Cog):
@@ -20,9 +23,27 @@ class GainsVision(commands.Cog):
         """
         self.client = client
         self._last_member = None
+        self.renderer = chart_renderer()
         self.logger = logging.getLogger(__name__)
         self.logger.info('GainsVision Cog instance created')
 
+    async def cog_load(self):
+        # warm up in the background rather than hold up the bot's login
+        self._warm_up = asyncio.create_task(self.renderer.start())
+        metrics.gauge("chart_cache_hits_total", "Charts served from the chart cache.",
+                      lambda: chart_cache.hits, "counter")
+        metrics.gauge("chart_cache_misses_total", "Charts that had to be rendered.",
+                      lambda: chart_cache.misses, "counter")
+        metrics.gauge("chart_renders_in_flight",
+                      "Charts being rendered or waiting for a worker.",
+                      lambda: self.renderer.in_flight)
+        metrics.gauge("chart_render_queue_depth", "Charts waiting for a free worker.",
+                      lambda: max(self.renderer.in_flight - self.renderer.workers, 0))
+
+    async def cog_unload(self):
+        self._warm_up.cancel()
+        await self.renderer.close()
+
     @commands.Cog.listener()
     async def on_ready(self):
         """
@@ -56,6 +77,7 @@ class GainsVision(commands.Cog):
         show="Use to only see the activities you list here, separated by a space"
     )
     @app_commands.command()
+    @timed
     async def see_gains(
         self, 
         interaction: discord.Interaction, 
@@ -76,19 +98,45 @@ class GainsVision(commands.Cog):
         /see_gains week line show: Jogging Pushups\n
         Use the word "show:" to only show certain activities! 
         """
-        await interaction.response.defer(thinking=True)
+        with metrics.phase("send"):
+            await interaction.response.defer(thinking=True)
         memory = self.client.get_cog("GainsMemory")
         if memory is not None:
-            ses, user = await memory._check_registered(interaction)
+            with metrics.phase("register"):
+                ses, user = await memory._check_registered(interaction)
         if user:
+            cache_key = chart_cache.key(user.id, days, plot_type, show)
+            png = await chart_cache.get(cache_key)
+            self.logger.debug(f"chart cache {'hit' if png else 'miss'}"
+                              f" ({chart_cache.hits} hits,"
+                              f" {chart_cache.misses} misses)")
+            if png:
+                await ses.close()
+                image = discord.File(io.BytesIO(png), filename="discord_activities.png")
+                with metrics.phase("send"):
+                    await interaction.followup.send(file=image)
+                return
             try:
-                exercises = pd.read_sql(ses.query(Exercise)
-                                        .filter(Exercise.user_id == user.id)
-                                        .statement, ses.bind)
-                exc_names = exercises.name.unique()
+                with metrics.phase("db"):
+                    activities = await crud.list_activities(ses, user.id)
+                exc_names = [name for name, _ in activities]
                 activity_filter = await self._parse_filter(exc_names, show)
+                # gains are stored per UTC day, so include the whole first day
+                start = (datetime.utcnow() - timedelta(days=days)).date()
+                # long windows are summed per week/month so charts stay readable
+                bucket = pick_bucket(days)
+                with metrics.phase("db"):
+                    result = await crud.daily_gains(ses, user.id, start,
+                                                    activity_filter, bucket)
+                # the chart workers only get plain data
+                rows = [(day, name, float(reps)) for day, name, reps in result]
             except Exception as e:
-                self.logger.error(f"Error creating exercise dataframe: {e}")
+                self.logger.error(f"Error loading exercise data: {e}")
+                await ses.close()
+                await interaction.followup.send(
+                    f"Sorry {interaction.user.name}, I couldn't load your gains right"
+                    " now! Please try `/see_gains` again in a minute.")
+                return
             if isinstance(days, str):
                 try:
                     days = int(days)
@@ -97,91 +145,23 @@ class GainsVision(commands.Cog):
                         days = float(days)
                     except ValueError:
                         await interaction.followup.send("There was a problem with your days, please input a whole number!")
-            if not activity_filter:
-                # this creates the df and filters by time
-                subset = exercises[exercises['date'] >
-                                (datetime.utcnow() -
-                                timedelta(days=days))]
-            else:
-                # filters by exercise name
-                subset = exercises[exercises['date'] >
-                                (datetime.utcnow() -
-                                timedelta(days=days))]
-                mask = subset['name'].isin(activity_filter)
-                subset = subset[mask]
-            ses.close()
-            subset = subset.set_index('date')
-            # create empty df filled with all dates in range
-            end = datetime.utcnow()
-            start = (end-timedelta(days=days))
-            dates = pd.date_range(start=start, end=end, freq='D')
-            idx_ref = pd.DatetimeIndex(dates)
-            idx_df = pd.DataFrame(index=idx_ref)
-            subset_exc = pd.merge(idx_df,
-                                  subset,
-                                  how='outer',
-                                  left_index=True,
-                                  right_index=True)
-            # All of these columns are unneeded for graphing
-            subset_exc = subset_exc.drop(["id", "user_id", "unit"], axis=1)
-
-            def add_populated_rows(names: List, df: pd.DataFrame) -> pd.DataFrame:
-                for row in df['name'].isna().index:
-                    ii = 0
-                    for name in names:
-                        ii += 1
-                        df.loc[row + timedelta(seconds=ii)] = [name, 0.0]
-                df = df.dropna(subset=['name'])
-                return df
-
-            exc_names = [n for n in subset_exc['name'].unique() if isinstance(n, str)]
-            subset_exc = add_populated_rows(exc_names, subset_exc)
-            # plotting logic
-            # see templates: https://plotly.com/python/templates/#theming-and-templates
-            # separate these out into different functions
-            if plot_type in ["hist", "histogram", "h", "his", "hgram"]:
-                get_max = subset_exc.groupby([pd.Grouper(freq='D'), "name"]) \
-                          .sum().reset_index(level="name")
-                fig = px.histogram(subset_exc,
-                                   x=subset_exc.index,
-                                   y="reps",
-                                   color="name",
-                                   labels={
-                                           "date": "Date",
-                                           "reps": "No. of Reps",
-                                           "name": "Activities:"
-                                          },
-                                   title="GAINS!",
-                                   template="plotly_dark+xgridoff",
-                                   nbins=days,
-                                   barmode="group"
-                                   )
-                max_val = get_max["reps"].max()
-                fig.update_layout(yaxis={"range": [0, max_val + max_val/10]})
-            else:
-                subset_exc = subset_exc.groupby([pd.Grouper(freq='D'), "name"]) \
-                             .sum().reset_index(level="name")
-                fig = px.line(subset_exc,
-                              x=subset_exc.index,
-                              y="reps",
-                              color="name",
-                              labels={
-                                      "index": "Date",
-                                      "date": "Date",
-                                      "reps": "Daily No. of Cumulative Reps",
-                                      "name": "Activities:"
-                                     },
-                              title="GAINS!",
-                              template="plotly_dark+xgridoff",
-                              )
-                fig.update_traces(mode="markers+lines", marker={"opacity": 0.5})
-                max_val = subset_exc["reps"].max()
-                fig.update_layout(yaxis={"range": [0, max_val + max_val/10]})
-            fig.write_image("activities.png")
-            with open("activities.png", "rb") as f:
-                file = io.BytesIO(f.read())
-            image = discord.File(file, filename="discord_activities.png")
-            await interaction.followup.send(file=image)
+            await ses.close()
+            if self.renderer.busy and not self.renderer.full:
+                await interaction.followup.send(
+                    f"{interaction.user.name}, lots of people are looking at their"
+                    " gains right now, your chart is queued and will be here shortly!")
+            try:
+                with metrics.phase("render"):
+                    png = await self.renderer.render(rows, days, plot_type, bucket)
+            except ChartQueueFull:
+                await interaction.followup.send(
+                    f"Sorry {interaction.user.name}, I'm drawing too many charts right"
+                    " now! Please try `/see_gains` again in a minute.")
+                return
+            await chart_cache.put(cache_key, png)
+            image = discord.File(io.BytesIO(png), filename="discord_activities.png")
+            with metrics.phase("send"):
+                await interaction.followup.send(file=image)
 
 async def setup(client):
     """
@@ -0,0 +1,42 @@
+"""
+Syncing the slash command tree only when it changed. Discord rate limits syncs hard, so
+the hash of the last synced tree is kept in the bot_state table and a sync whose tree
+hashes the same is skipped.
+"""
+import hashlib
+import json
+import logging
+
+from gainsworth.db import crud
+
+
+SYNC_STATE_KEY = "command_tree_hash"
+
+logger = logging.getLogger(__name__)
+
+
+def tree_hash(tree):
+    """
+    Hashes the global commands as they'd be sent to Discord (names, descriptions,
+    options).
+    """
+    commands = sorted((command.to_dict() for command in tree.get_commands()),
+                      key=lambda command: (command.get("type", 1), command["name"]))
+    return hashlib.sha256(json.dumps(commands, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_if_changed(tree, force=False):
+    """Syncs the global command tree unless it's unchanged since the last sync."""
+    digest = tree_hash(tree)
+    ses = crud.get_session()
+    try:
+        if not force and await crud.get_state(ses, SYNC_STATE_KEY) == digest:
+            logger.info(f"command tree {digest[:12]} already synced, skipping")
+            return False
+        synced = await tree.sync()
+        await crud.set_state(ses, SYNC_STATE_KEY, digest)
+        await ses.commit()
+    finally:
+        await ses.close()
+    logger.info(f"synced {len(synced)} commands, tree {digest[:12]}")
+    return True
@@ -0,0 +1,229 @@
+"""
+Optional write-behind buffer for gains, turned on with WRITE_BEHIND=True.
+
+Gains are appended to a local journal file, acknowledged straight away and written to
+the database in batches, once WRITE_BEHIND_BATCH_SIZE gains are waiting or every
+WRITE_BEHIND_INTERVAL seconds. The journal is replayed on start, so gains acknowledged
+before a crash are still written. A crash between a commit and the journal cleanup can
+write that batch twice; everything else is written exactly once. A line a crash cut
+short was never acknowledged, and is logged and skipped on replay.
+
+When the database refuses a batch, its gains are written one at a time and the ones it
+still refuses go to the dead letter file (the journal's name plus ".dead") rather than
+holding back everyone else's. Connection trouble keeps the whole batch for the next try.
+"""
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+import json
+import logging
+import os
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from . import crud
+from .models import Activity
+
+
+def _dump(gain, **extra):
+    return json.dumps({"user_id": gain["user_id"],
+                       "activity_id": gain["activity_id"],
+                       "reps": str(gain["reps"]),
+                       "date": gain["date"].isoformat(),
+                       **extra})
+
+
+def _load(line):
+    gain = json.loads(line)
+    gain["reps"] = Decimal(gain["reps"])
+    gain["date"] = datetime.fromisoformat(gain["date"])
+    return gain
+
+
+def _refused(error):
+    # asyncpg reports most bad values as plain DBAPIErrors, so rule out connection
+    # trouble
+    return (isinstance(error, DBAPIError) and not error.connection_invalidated
+            and not isinstance(error, (InterfaceError, OperationalError)))
+
+
+class GainBuffer:
+    def __init__(self, journal_path, batch_size=500, interval=2.0):
+        self.journal = Path(journal_path)
+        # gains taken out of the journal for a flush live here until they commit
+        self.flushing = self.journal.with_name(self.journal.name + ".flushing")
+        self.dead_letters = self.journal.with_name(self.journal.name + ".dead")
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = asyncio.Queue()
+        self.on_flush = []
+        self.logger = logging.getLogger(__name__)
+        self._pending = []
+        self._journal_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        """Replays anything a previous run left in the journal and starts flushing."""
+        replayed = await asyncio.to_thread(self._read, self.flushing)
+        replayed += await asyncio.to_thread(self._read, self.journal)
+        # rewritten from what could be read, so no new line lands after a cut short one
+        await asyncio.to_thread(self._rotate)
+        if replayed:
+            await asyncio.to_thread(self._replace_flushing, replayed)
+            self.logger.info(f"replaying {len(replayed)} journaled gains")
+            self._pending = replayed
+            await self.flush()
+        else:
+            await asyncio.to_thread(self.flushing.unlink, missing_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background flusher and writes whatever is still queued."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def put(self, gains):
+        """
+        Journals gains (dicts as taken by crud.record_gains) and queues them. Raises
+        ValueError, before journaling anything, if an amount can't be stored.
+        """
+        for gain in gains:
+            if not crud.valid_reps(gain["reps"]):
+                raise ValueError(f"can't store {gain['reps']} reps")
+        async with self._journal_lock:
+            await asyncio.to_thread(self._append, [_dump(gain) for gain in gains])
+            for gain in gains:
+                self.queue.put_nowait(gain)
+        if self.queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """
+        Writes every queued gain, in one transaction if it can, returns how many went
+        in.
+        """
+        async with self._flush_lock:
+            async with self._journal_lock:
+                await asyncio.to_thread(self._rotate)
+                while not self.queue.empty():
+                    self._pending.append(self.queue.get_nowait())
+            if not self._pending:
+                return 0
+            batch = len(self._pending)
+            written = []
+            try:
+                try:
+                    written = await self._write(self._pending)
+                    self._pending = []
+                except Exception as e:
+                    if not _refused(e):
+                        raise
+                    self.logger.warning(f"database refused {batch} gains, writing them"
+                                        f" one at a time: {e}")
+                    while self._pending:
+                        try:
+                            written += await self._write(self._pending[:1])
+                        except Exception as e:
+                            if not _refused(e):
+                                raise
+                            await asyncio.to_thread(self._dead_letter,
+                                                    self._pending[0], e)
+                        self._pending.pop(0)
+            except Exception as e:
+                self.logger.error(f"failed to flush {len(self._pending)} gains,"
+                                  f" will retry: {e}")
+                if written:
+                    # what got through mustn't be written again after a crash
+                    await asyncio.to_thread(self._replace_flushing, self._pending)
+            else:
+                await asyncio.to_thread(self.flushing.unlink, missing_ok=True)
+                self.logger.info(f"flushed {len(written)} of {batch} gains")
+            if written:
+                for callback in self.on_flush:
+                    callback(written)
+            return len(written)
+
+    async def _write(self, gains):
+        """Writes gains in one transaction, returns those whose activities exist."""
+        ses = crud.get_session()
+        try:
+            # activities (or whole users) removed since queueing take their gains along
+            live = set((await ses.scalars(select(Activity.id).filter(
+                Activity.id.in_({gain["activity_id"] for gain in gains})))).all())
+            gains = [gain for gain in gains if gain["activity_id"] in live]
+            await crud.record_gains(ses, gains)
+            await ses.commit()
+            return gains
+        finally:
+            # rolls back anything left uncommitted
+            await ses.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # e.g. a full disk; the gains stay queued or journaled for the next try
+                self.logger.exception(f"write-behind flush failed: {e}")
+
+    def _append(self, lines):
+        with open(self.journal, "a") as journal:
+            journal.write("".join(line + "\n" for line in lines))
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _dead_letter(self, gain, error):
+        self.logger.error(f"giving up on gain {gain}, kept in {self.dead_letters}:"
+                          f" {error}")
+        with open(self.dead_letters, "a") as dead_letters:
+            dead_letters.write(_dump(gain, error=str(error).splitlines()[0]) + "\n")
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+
+    def _replace_flushing(self, gains):
+        replacement = self.flushing.with_name(self.flushing.name + ".tmp")
+        with open(replacement, "w") as flushing:
+            flushing.write("".join(_dump(gain) + "\n" for gain in gains))
+            flushing.flush()
+            os.fsync(flushing.fileno())
+        os.replace(replacement, self.flushing)
+
+    def _rotate(self):
+        # moves the journal's contents onto the end of the flushing file
+        if not self.journal.exists():
+            return
+        with open(self.journal) as journal, open(self.flushing, "a") as flushing:
+            flushing.write(journal.read())
+            flushing.flush()
+            os.fsync(flushing.fileno())
+        self.journal.unlink()
+
+    def _read(self, path):
+        if not path.exists():
+            return []
+        gains = []
+        with open(path) as journal:
+            for line in journal:
+                if not line.strip():
+                    continue
+                try:
+                    gains.append(_load(line))
+                except (ArithmeticError, KeyError, TypeError, ValueError) as e:
+                    self.logger.error(f"skipping unreadable line in {path}: {line!r}"
+                                      f" ({e})")
+        return gains
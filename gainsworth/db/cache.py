@@ -0,0 +1,64 @@
+"""
+In-process cache of registered users, so commands can skip the registration lookup.
+
+Entries map a Discord user id to a CachedUser and expire after IDENTITY_CACHE_TTL
+seconds; at most IDENTITY_CACHE_SIZE entries are kept, least recently used first out.
+Anything that deletes a user or changes its flags must invalidate the entry. That only
+reaches this process: with the shards split across processes (see sharding.py), the
+others keep serving their copy until it expires, so e.g. a user removed through one
+process can still have gains taken by another for up to IDENTITY_CACHE_TTL seconds.
+Lower the TTL if that matters.
+"""
+from collections import OrderedDict, namedtuple
+import time
+
+from decouple import config
+
+
+CachedUser = namedtuple("CachedUser", ["id", "user_id", "name", "auto_remove"])
+
+
+class IdentityCache:
+    def __init__(self, maxsize=10000, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, discord_id):
+        entry = self._entries.get(discord_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            del self._entries[discord_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(discord_id)
+        self.hits += 1
+        return user
+
+    def put(self, user):
+        """Caches a User row (or CachedUser) and returns the cached copy."""
+        cached = CachedUser(user.id, user.user_id, user.name, user.auto_remove)
+        self._entries[cached.user_id] = (cached, time.monotonic() + self.ttl)
+        self._entries.move_to_end(cached.user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, discord_id):
+        self._entries.pop(discord_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+identity_cache = IdentityCache(
+    maxsize=config("IDENTITY_CACHE_SIZE", default=10000, cast=int),
+    ttl=config("IDENTITY_CACHE_TTL", default=600, cast=float))
@@ -1,31 +1,494 @@
-from datetime import datetime
+"""
+Shared database access for the Gainsworth cogs.
 
-from .models import Base, Exercise, User
+The engine is created lazily on first use, so importing a cog (or the tests) does not
+require a DATABASE_URL. Pool behaviour can be tuned from the environment:
+DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE (seconds) and
+DB_STATEMENT_TIMEOUT (milliseconds, Postgres only).
+
+Repository functions take an open AsyncSession and leave committing to the caller,
+unless noted otherwise.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import groupby
+import json
+import zlib
 
 from decouple import config
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Date, delete, event, func, insert, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from . import profiling
+from .models import (Activity, BotState, BroadcastDelivery, DailyGain, Exercise,
+                     ExerciseArchive, User)
+
 
+_engine = None
+_sessionmaker = None
 
-if __name__ == "__main__":
+
+def database_url():
+    """
+    Reads DATABASE_URL and points Postgres URLs at the asyncpg driver. Heroku still
+    hands out 'postgres://' URLs, which SQLAlchemy no longer accepts.
+    """
     url = config("DATABASE_URL")
-    if url:
-        if "postgresql" not in url:
-            url = url.replace("postgres", "postgresql")
-    engine = create_engine(url)
-    Session = sessionmaker(bind=engine)
-
-    ses = Session()
-    name = User(name="Razzlestorm", date_created=datetime.utcnow())
-    exercise = Exercise(name="push-ups",
-                        reps=0,
-                        date=datetime.utcnow())
-    ses.add(name)
-    ses.add(exercise)
-    ses.commit()
-    print("checking if connection creates user: ")
-    print(ses.query(User).first().name, ses.query(User).first().date_created)
-    print("checking if connection creates exercise: ")
-    print(ses.query(Exercise).first().name, ses.query(Exercise).first().reps)
-    ses.close_all()
-    recreate_database()
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+def _engine_options(url):
+    if not url.startswith("postgresql"):
+        return {}
+    timeout = config("DB_STATEMENT_TIMEOUT", default=0, cast=int)
+    options = {
+        "pool_size": config("DB_POOL_SIZE", default=5, cast=int),
+        "max_overflow": config("DB_MAX_OVERFLOW", default=2, cast=int),
+        "pool_pre_ping": config("DB_POOL_PRE_PING", default=True, cast=bool),
+        "pool_recycle": config("DB_POOL_RECYCLE", default=1800, cast=int),
+    }
+    if timeout:
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(timeout)}}
+    return options
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless asked, Postgres always honours it.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def get_engine():
+    """Returns the process-wide AsyncEngine, creating it on first call."""
+    global _engine
+    if _engine is None:
+        url = database_url()
+        _engine = create_async_engine(url, **_engine_options(url))
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine.sync_engine, "connect", _enable_sqlite_foreign_keys)
+        profiling.instrument(_engine.sync_engine)
+    return _engine
+
+
+def get_session():
+    """Opens a new AsyncSession on the shared engine."""
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+    return _sessionmaker()
+
+
+async def dispose_engine():
+    """Closes every pooled connection, the next get_engine() call starts fresh."""
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _sessionmaker = None
+
+
+async def get_user(ses, discord_id):
+    return await ses.scalar(select(User).filter(User.user_id == discord_id))
+
+
+async def register_user(ses, discord_id, name):
+    """
+    Finds the User for a Discord account, creating it (or adopting a legacy row
+    registered by name only) when needed, and keeps the stored name current.
+    Commits any change it makes.
+    """
+    user = await get_user(ses, discord_id)
+    if not user:
+        # Discord hands out freed names again, so a row with the name and another
+        # account's id isn't this account's
+        user = await ses.scalar(select(User).filter(User.name == name)
+                                .filter(or_(User.user_id.is_(None), User.user_id == 0)))
+        if not user:
+            user = User(name=name,
+                        user_id=discord_id,
+                        date_created=datetime.utcnow(),
+                        last_active=datetime.utcnow())
+            ses.add(user)
+        else:
+            user.user_id = discord_id
+        await ses.commit()
+    if user.name != name:
+        user.name = name
+        await ses.commit()
+    return user
+
+
+async def get_activity(ses, user_id, name):
+    return await ses.scalar(select(Activity).filter(Activity.user_id == user_id)
+                            .filter(Activity.name == name))
+
+
+async def create_activity(ses, user_id, name, unit=None):
+    activity = Activity(name=name,
+                        unit=unit,
+                        date_created=datetime.utcnow(),
+                        user_id=user_id)
+    ses.add(activity)
+    return activity
+
+
+async def user_activities(ses, user_id):
+    """Returns a user's activities keyed by name."""
+    activities = await ses.scalars(select(Activity).filter(Activity.user_id == user_id))
+    return {activity.name: activity for activity in activities}
+
+
+async def list_activities(ses, user_id):
+    """Returns (name, unit) tuples in the order the activities were created."""
+    return (await ses.execute(select(Activity.name, Activity.unit)
+                              .filter(Activity.user_id == user_id)
+                              .order_by(Activity.id))).all()
+
+
+async def has_activities(ses, user_id):
+    return await ses.scalar(select(Activity.id).filter(Activity.user_id == user_id)
+                            .limit(1)) is not None
+
+
+def _insert(ses, table):
+    # ON CONFLICT is dialect specific, both supported backends spell it the same way.
+    if ses.bind.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+# exercises.reps and daily_gains.reps are Numeric(12, 2)
+MAX_REPS = Decimal(10) ** 10
+
+
+def valid_reps(reps):
+    """Whether a Decimal amount can be stored: finite and smaller than MAX_REPS."""
+    return reps.is_finite() and abs(reps) < MAX_REPS
+
+
+async def record_gains(ses, gains):
+    """
+    Writes gains, given as dicts of user_id, activity_id, reps and date, with one
+    multi-row INSERT and folds them into the daily rollup with one upsert, all in the
+    caller's transaction.
+    """
+    if not gains:
+        return
+    await ses.execute(insert(Exercise).values(gains))
+    totals = defaultdict(Decimal)
+    for gain in gains:
+        key = (gain["activity_id"], gain["date"].date(), gain["user_id"])
+        totals[key] += gain["reps"]
+    # Postgres refuses to upsert one row twice per statement, hence the totals above.
+    stmt = _insert(ses, DailyGain).values([{"activity_id": activity_id,
+                                            "day": day,
+                                            "user_id": user_id,
+                                            "reps": reps}
+                                           for (activity_id, day, user_id), reps
+                                           in totals.items()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyGain.activity_id, DailyGain.day],
+        set_={"reps": DailyGain.reps + stmt.excluded.reps})
+    await ses.execute(stmt)
+    user_ids = {gain["user_id"] for gain in gains}
+    await ses.execute(update(User).filter(User.id.in_(user_ids))
+                      .values(last_active=datetime.utcnow()))
+
+
+def _exercise_totals(*filters):
+    # (activity_id, day, user_id, reps) per day of the exercise log, for from_select
+    day = func.date(Exercise.date)
+    return (select(Exercise.activity_id, day, Exercise.user_id, func.sum(Exercise.reps))
+            .filter(Exercise.user_id.is_not(None), *filters)
+            .group_by(Exercise.activity_id, day, Exercise.user_id))
+
+
+async def rebuild_daily_gains(ses, batch_size=500):
+    """
+    Recomputes the daily rollup from the exercise log and the exercise archive and
+    returns its row count.
+    """
+    await ses.execute(delete(DailyGain))
+    await ses.execute(DailyGain.__table__.insert()
+                      .from_select(["activity_id", "day", "user_id", "reps"],
+                                   _exercise_totals()))
+    last_id = 0
+    while blobs := (await ses.scalars(select(ExerciseArchive)
+                                      .filter(ExerciseArchive.id > last_id)
+                                      .order_by(ExerciseArchive.id)
+                                      .limit(batch_size))).all():
+        last_id = blobs[-1].id
+        # archives keep activity names, which are unique per user
+        activities = await ses.execute(
+            select(Activity.id, Activity.user_id, Activity.name)
+            .filter(Activity.user_id.in_({blob.user_id for blob in blobs})))
+        activity_ids = {(user_id, name): activity_id
+                        for activity_id, user_id, name in activities.all()}
+        totals = defaultdict(Decimal)
+        for blob in blobs:
+            for name, _, reps, date in unpack_archive(blob):
+                activity_id = activity_ids.get((blob.user_id, name))
+                if activity_id is not None:
+                    totals[(activity_id, date.date(), blob.user_id)] += reps
+        rows = [{"activity_id": activity_id, "day": day, "user_id": user_id,
+                 "reps": reps}
+                for (activity_id, day, user_id), reps in totals.items()]
+        # a few thousand rows per statement keeps clear of the bound parameter limits
+        for ii in range(0, len(rows), 5000):
+            stmt = _insert(ses, DailyGain).values(rows[ii:ii + 5000])
+            await ses.execute(stmt.on_conflict_do_update(
+                index_elements=[DailyGain.activity_id, DailyGain.day],
+                set_={"reps": DailyGain.reps + stmt.excluded.reps}))
+    return await ses.scalar(select(func.count()).select_from(DailyGain))
+
+
+async def sum_gains(ses, user_id, start):
+    """Returns (name, unit, total) rows for every gain logged since start's UTC day."""
+    totals = await ses.execute(select(Activity.name,
+                                      Activity.unit,
+                                      func.sum(DailyGain.reps))
+                               .join(DailyGain, DailyGain.activity_id == Activity.id)
+                               .filter(DailyGain.user_id == user_id)
+                               .filter(DailyGain.day >= start.date())
+                               .group_by(Activity.id, Activity.name, Activity.unit))
+    return totals.all()
+
+
+# date() modifiers moving a day to the start of its week (Monday), month or year
+SQLITE_BUCKETS = {
+    "week": ("-6 days", "weekday 1"),
+    "month": ("start of month",),
+    "year": ("start of year",),
+}
+
+
+def _truncate(ses, day, bucket):
+    if ses.bind.dialect.name == "postgresql":
+        return func.date(func.date_trunc(bucket, day), type_=Date)
+    return func.date(day, *SQLITE_BUCKETS[bucket], type_=Date)
+
+
+async def daily_gains(ses, user_id, start=None, names=None, bucket="day"):
+    """
+    Returns (date, name, reps) rows, one per activity per day a user logged gains,
+    oldest first. start (a date) and names (activity names) narrow the rows down;
+    bucket "week", "month" or "year" sums them per week (from Monday), month or year.
+    """
+    day = DailyGain.day if bucket == "day" else _truncate(ses, DailyGain.day, bucket)
+    query = select(day.label("date"), Activity.name, func.sum(DailyGain.reps)) \
+        .join(Activity, DailyGain.activity_id == Activity.id) \
+        .filter(DailyGain.user_id == user_id)
+    if start is not None:
+        query = query.filter(DailyGain.day >= start)
+    if names:
+        query = query.filter(Activity.name.in_(names))
+    query = query.group_by(day, Activity.id, Activity.name).order_by(day)
+    return (await ses.execute(query)).all()
+
+
+async def delete_activity(ses, user_id, name):
+    """
+    Deletes an activity and its whole log, archived months included, returning how
+    many gains went with it.
+    """
+    activity = await get_activity(ses, user_id, name)
+    if not activity:
+        return 0
+    removed = (await ses.execute(delete(Exercise)
+                                 .filter(Exercise.activity_id == activity.id))).rowcount
+    for blob in (await ses.scalars(select(ExerciseArchive)
+                                   .filter(ExerciseArchive.user_id == user_id))).all():
+        entries = json.loads(zlib.decompress(blob.payload))
+        kept = [entry for entry in entries if entry[0] != activity.name]
+        removed += len(entries) - len(kept)
+        if not kept:
+            await ses.delete(blob)
+        elif len(kept) < len(entries):
+            blob.row_count = len(kept)
+            blob.payload = _pack(kept)
+    await ses.execute(delete(Activity).filter(Activity.id == activity.id))
+    return removed
+
+
+async def delete_user(ses, user_id):
+    return (await ses.execute(delete(User).filter(User.id == user_id))).rowcount
+
+
+async def set_auto_remove(ses, user_id, value):
+    user = await ses.get(User, user_id)
+    user.auto_remove = value
+    return user
+
+
+def _next_month(month):
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month):
+    return f"exercises_y{month.year}m{month.month:02d}"
+
+
+async def _partition_exists(ses, name):
+    found = await ses.scalar(text("SELECT to_regclass(:name)"), {"name": name})
+    return found is not None
+
+
+async def ensure_exercise_partitions(ses, months_ahead=2):
+    """
+    Creates the monthly exercise partitions from this month to months_ahead months
+    out and returns the names it created. Does nothing outside Postgres.
+    """
+    if ses.bind.dialect.name != "postgresql":
+        return []
+    created = []
+    month = datetime.utcnow().date().replace(day=1)
+    for _ in range(months_ahead + 1):
+        name = partition_name(month)
+        if not await _partition_exists(ses, name):
+            await ses.execute(text(f"CREATE TABLE {name} PARTITION OF exercises"
+                                   f" FOR VALUES FROM ('{month}')"
+                                   f" TO ('{_next_month(month)}')"))
+            created.append(name)
+        month = _next_month(month)
+    return created
+
+
+async def drop_exercise_partitions_before(ses, cutoff):
+    """
+    Drops monthly partitions that end on or before cutoff and returns their names.
+    Only call this once those months are archived, their rows go with them.
+    """
+    if ses.bind.dialect.name != "postgresql":
+        return []
+    names = (await ses.scalars(text("SELECT inhrelid::regclass::text FROM pg_inherits"
+                                    " WHERE inhparent = 'exercises'::regclass"))).all()
+    dropped = []
+    for name in sorted(names):
+        if not name.startswith("exercises_y"):
+            continue
+        year, month = name[len("exercises_y"):].split("m")
+        if _next_month(cutoff.replace(year=int(year), month=int(month))) <= cutoff:
+            await ses.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+async def oldest_exercise_month(ses):
+    oldest = await ses.scalar(select(func.min(Exercise.date)))
+    return oldest.date().replace(day=1) if oldest else None
+
+
+async def archive_exercise_month(ses, month, batch_size=500):
+    """
+    Moves one month of the exercise log into exercise_archive, as one compressed blob
+    per user, then drops that month's partition on Postgres. Returns the number of
+    rows archived. The month's days in the daily rollup are recomputed from its rows
+    first, so totals and charts keep covering it; rebuild_daily_gains reads them back
+    from the archive.
+    """
+    end = _next_month(month)
+    in_month = (Exercise.date >= month) & (Exercise.date < end)
+    await ses.execute(delete(DailyGain).filter(DailyGain.day >= month,
+                                               DailyGain.day < end))
+    await ses.execute(DailyGain.__table__.insert()
+                      .from_select(["activity_id", "day", "user_id", "reps"],
+                                   _exercise_totals(in_month)))
+    # plain paged reads: an open server-side cursor would block the DROP below
+    user_ids = (await ses.scalars(select(Exercise.user_id).distinct()
+                                  .filter(in_month)
+                                  .filter(Exercise.user_id.is_not(None))
+                                  .order_by(Exercise.user_id))).all()
+    archived = 0
+    for ii in range(0, len(user_ids), batch_size):
+        rows = (await ses.execute(select(Exercise.user_id,
+                                         Activity.name,
+                                         Activity.unit,
+                                         Exercise.reps,
+                                         Exercise.date)
+                                  .join(Activity, Exercise.activity_id == Activity.id)
+                                  .filter(in_month)
+                                  .filter(Exercise.user_id.in_(
+                                      user_ids[ii:ii + batch_size]))
+                                  .order_by(Exercise.user_id, Exercise.date))).all()
+        blobs = []
+        for user_id, user_rows in groupby(rows, key=lambda row: row.user_id):
+            entries = [[row.name, row.unit, str(row.reps), row.date.isoformat()]
+                       for row in user_rows]
+            blobs.append({"user_id": user_id,
+                          "month": month,
+                          "row_count": len(entries),
+                          "payload": _pack(entries)})
+            archived += len(entries)
+        await ses.execute(insert(ExerciseArchive), blobs)
+    name = partition_name(month)
+    if ses.bind.dialect.name == "postgresql" and await _partition_exists(ses, name):
+        await ses.execute(text(f"DROP TABLE {name}"))
+    # whatever is left sits in the default partition (or an unpartitioned table)
+    await ses.execute(delete(Exercise).filter(in_month))
+    return archived
+
+
+def _pack(entries):
+    return zlib.compress(json.dumps(entries).encode(), 9)
+
+
+def unpack_archive(archive):
+    """Returns an ExerciseArchive's rows as (name, unit, reps, date) tuples."""
+    return [(name, unit, Decimal(reps), datetime.fromisoformat(date))
+            for name, unit, reps, date in json.loads(zlib.decompress(archive.payload))]
+
+
+async def backfill_last_active(ses):
+    """Marks users who predate the last_active column as active now."""
+    return (await ses.execute(update(User).filter(User.last_active.is_(None))
+                              .values(last_active=datetime.utcnow()))).rowcount
+
+
+async def inactive_users(ses, cutoff, limit):
+    """
+    Returns up to limit (id, user_id) rows of auto-removable users idle since cutoff.
+    """
+    return (await ses.execute(select(User.id, User.user_id)
+                              .filter(User.auto_remove.is_(True))
+                              .filter(User.last_active < cutoff)
+                              .order_by(User.id)
+                              .limit(limit))).all()
+
+
+async def delete_users(ses, ids):
+    return (await ses.execute(delete(User).filter(User.id.in_(ids)))).rowcount
+
+
+async def delivered_guilds(ses, version):
+    """Returns the ids of guilds a changelog version needn't be sent to again."""
+    return set((await ses.scalars(select(BroadcastDelivery.guild_id)
+                                  .filter(BroadcastDelivery.version == version))).all())
+
+
+async def record_delivery(ses, version, guild_id, channel_id, status):
+    stmt = _insert(ses, BroadcastDelivery).values(version=version,
+                                                  guild_id=guild_id,
+                                                  channel_id=channel_id,
+                                                  status=status,
+                                                  date=datetime.utcnow())
+    await ses.execute(stmt.on_conflict_do_update(
+        index_elements=["version", "guild_id"],
+        set_={"channel_id": stmt.excluded.channel_id,
+              "status": stmt.excluded.status,
+              "date": stmt.excluded.date}))
+
+
+async def get_state(ses, key):
+    return await ses.scalar(select(BotState.value).filter(BotState.key == key))
+
+
+async def set_state(ses, key, value):
+    stmt = _insert(ses, BotState).values(key=key, value=value)
+    await ses.execute(stmt.on_conflict_do_update(index_elements=["key"],
+                                                 set_={"value": stmt.excluded.value}))
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, BigInteger, Column, DateTime, ForeignKey, Integer, Numeric, String
+from sqlalchemy import (Boolean, BigInteger, Column, Date, DateTime, ForeignKey, Index,
+                        Integer, LargeBinary, Numeric, String, UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -8,11 +9,12 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
-    user_id = Column(BigInteger, nullable=False)
-    name = Column(String, nullable=False)
+    user_id = Column(BigInteger, nullable=False, unique=True, index=True)
+    name = Column(String, nullable=False, index=True)
     exercises = relationship('Exercise', cascade="all, delete")
+    activities = relationship('Activity', cascade="all, delete")
     date_created = Column(DateTime)
-    last_active = Column(DateTime)
+    last_active = Column(DateTime, index=True)
     auto_remove = Column(Boolean, default=True, nullable=False)
     reminder_interval = Column(Integer)
 
@@ -21,15 +23,103 @@ class User(Base):
                 f"Exercises: {self.exercises}")
 
 
-class Exercise(Base):
-    __tablename__ = 'exercises'
+class Activity(Base):
+    __tablename__ = 'activities'
+    __table_args__ = (
+        UniqueConstraint("user_id", "name", name="uq_activities_user_id_name"),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     unit = Column(String)
+    date_created = Column(DateTime)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"),
+                     nullable=False)
+    exercises = relationship('Exercise', cascade="all, delete")
+
+    def __repr__(self):
+        return f"<Activity(name='{self.name}', unit='{self.unit}')>"
+
+
+class Exercise(Base):
+    # On Postgres this table is range-partitioned by month on date, with (id, date) as
+    # the primary key, see alembic revision a5d03c7f1e62.
+    __tablename__ = 'exercises'
+    __table_args__ = (
+        Index("ix_exercises_activity_id_date", "activity_id", "date"),
+        Index("ix_exercises_user_id_date", "user_id", "date"),
+    )
+    id = Column(Integer, primary_key=True)
     reps = Column(Numeric(precision=12, scale=2))
     date = Column(DateTime)
     user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"))
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete="CASCADE"),
+                         nullable=False)
 
     def __repr__(self):
-        return (f"<Exercise(name='{self.name}', unit='{self.unit}', "
+        return (f"<Exercise(activity_id='{self.activity_id}', "
                 f"reps='{self.reps}', date='{self.date}')>")
+
+
+class DailyGain(Base):
+    """Running total of one activity's gains for one UTC day, see crud.record_gains."""
+    __tablename__ = 'daily_gains'
+    __table_args__ = (
+        Index("ix_daily_gains_user_id_day", "user_id", "day"),
+    )
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete="CASCADE"),
+                         primary_key=True)
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"),
+                     nullable=False)
+    reps = Column(Numeric(precision=12, scale=2), nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<DailyGain(activity_id='{self.activity_id}', day='{self.day}', "
+                f"reps='{self.reps}')>")
+
+
+class ExerciseArchive(Base):
+    """One user's exercise rows for one month, as zlib-compressed JSON."""
+    __tablename__ = 'exercise_archive'
+    __table_args__ = (
+        Index("ix_exercise_archive_user_id_month", "user_id", "month"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"),
+                     nullable=False)
+    month = Column(Date, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return (f"<ExerciseArchive(user_id='{self.user_id}', month='{self.month}', "
+                f"row_count='{self.row_count}')>")
+
+
+class BroadcastDelivery(Base):
+    """Outcome of sending a changelog version to a guild, so broadcasts can resume."""
+    __tablename__ = 'broadcast_deliveries'
+    __table_args__ = (
+        UniqueConstraint("version", "guild_id",
+                         name="uq_broadcast_deliveries_version_guild_id"),
+    )
+    id = Column(Integer, primary_key=True)
+    version = Column(String, nullable=False)
+    guild_id = Column(BigInteger, nullable=False)
+    channel_id = Column(BigInteger)
+    status = Column(String, nullable=False)
+    date = Column(DateTime)
+
+    def __repr__(self):
+        return (f"<BroadcastDelivery(version='{self.version}', "
+                f"guild_id='{self.guild_id}', status='{self.status}')>")
+
+
+class BotState(Base):
+    """Named values kept between restarts, like the last synced command tree."""
+    __tablename__ = 'bot_state'
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+    def __repr__(self):
+        return f"<BotState(key='{self.key}', value='{self.value}')>"
@@ -0,0 +1,96 @@
+"""
+Statement timing for the shared engine, see instrument.
+
+Every statement's duration is tallied per call site, the Gainsworth code that ran it,
+e.g. "gainsworth_memory.py:115 add_gains > crud.py:141 user_activities", and counted
+against the command being tracked (see metrics.record_query), which flags commands
+running more than MAX_QUERIES_PER_COMMAND statements. Statements slower than
+SLOW_QUERY_MS are logged with their call site.
+"""
+from collections import defaultdict
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+
+from decouple import config
+from greenlet import getcurrent
+from sqlalchemy import event
+
+from gainsworth.metrics import metrics
+
+
+SLOW_QUERY_MS = config("SLOW_QUERY_MS", default=200, cast=float)
+
+DB_DIR = os.path.dirname(__file__)
+PACKAGE_DIR = os.path.dirname(DB_DIR)
+
+logger = logging.getLogger(__name__)
+# call site -> [statements, seconds]
+sites = defaultdict(lambda: [0, 0.0])
+
+
+def _frames():
+    # the async engine runs statements in a greenlet, whose parent holds the awaiting
+    # code
+    frame = sys._getframe(2)
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+    parent = getcurrent().parent
+    frame = parent.gr_frame if parent is not None else None
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def call_site():
+    """The innermost Gainsworth frame running a statement and, if that's in the db
+    layer, the innermost one outside it."""
+    inner = None
+    for frame in _frames():
+        filename = frame.f_code.co_filename
+        if not filename.startswith(PACKAGE_DIR) or filename == __file__:
+            continue
+        site = f"{Path(filename).name}:{frame.f_lineno} {frame.f_code.co_name}"
+        if not filename.startswith(DB_DIR):
+            return f"{site} > {inner}" if inner else site
+        inner = inner or site
+    return inner or "unknown"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    site = call_site()
+    tally = sites[site]
+    tally[0] += 1
+    tally[1] += seconds
+    metrics.record_query(site)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"slow query ({seconds * 1000:.0f} ms) from {site}:"
+                       f" {' '.join(statement.split())[:500]}")
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+def instrument(engine):
+    """Hooks statement timing onto a (sync) Engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def slowest_sites(count=5):
+    """(site, statements, seconds) for the sites spending the most time in queries."""
+    ranked = sorted(sites.items(), key=lambda item: -item[1][1])
+    return [(site, statements, seconds)
+            for site, (statements, seconds) in ranked[:count]]
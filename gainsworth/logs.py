@@ -0,0 +1,65 @@
+"""
+Logging for the bot process. Records are put on an in-memory queue by a QueueHandler and
+written to the log file and the console by a QueueListener thread, so a slow disk never
+holds up the event loop. The file rotates by size, or by time with LOG_ROTATE_WHEN
+(anything TimedRotatingFileHandler takes, e.g. "midnight").
+
+LOG_LEVELS sets per logger levels, e.g.
+"gainsworth=DEBUG,gainsworth.db=INFO,discord=WARNING".
+"""
+import logging
+from logging.handlers import (QueueHandler, QueueListener, RotatingFileHandler,
+                              TimedRotatingFileHandler)
+from queue import SimpleQueue
+import sys
+
+from decouple import Csv, config
+
+
+LOG_FILE = config("LOG_FILE", default="gainsworth_debug.log")
+LOG_LEVELS = config("LOG_LEVELS", default="gainsworth=DEBUG", cast=Csv())
+LOG_CONSOLE_LEVEL = config("LOG_CONSOLE_LEVEL", default="ERROR")
+LOG_ROTATE_WHEN = config("LOG_ROTATE_WHEN", default="")
+LOG_MAX_BYTES = config("LOG_MAX_BYTES", default=10 * 1024 * 1024, cast=int)
+LOG_BACKUPS = config("LOG_BACKUPS", default=5, cast=int)
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def parse_levels(levels):
+    """Turns ["name=LEVEL", ...] into {"name": LEVEL}, a bare level is the root's."""
+    parsed = {}
+    for entry in levels:
+        name, _, level = entry.rpartition("=")
+        parsed[name.strip() or None] = level.strip().upper()
+    return parsed
+
+
+def file_handler():
+    if LOG_ROTATE_WHEN:
+        return TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN,
+                                        backupCount=LOG_BACKUPS)
+    return RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                               backupCount=LOG_BACKUPS)
+
+
+def setup_logging():
+    """
+    Routes every logger through a queue and returns the (not yet started) listener that
+    does the writing. Start it before the bot and stop it last, stopping flushes the
+    queue.
+    """
+    formatter = logging.Formatter(FORMAT)
+    to_file = file_handler()
+    to_file.setLevel(logging.DEBUG)
+    to_file.setFormatter(formatter)
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(LOG_CONSOLE_LEVEL.upper())
+    console.setFormatter(formatter)
+
+    records = SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(records))
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    return QueueListener(records, to_file, console, respect_handler_level=True)
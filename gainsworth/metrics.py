@@ -0,0 +1,180 @@
+"""
+Per-command latency and throughput metrics, kept in memory and shown by the stats cog.
+
+metrics.track(command) times one run of a command, and metrics.phase(name) times a part
+of it (registration lookup, db, render, send), both feeding histograms keyed by command
+and phase. Database statements run while a command is tracked are counted against it
+(see db/profiling.py), and a run with more than MAX_QUERIES_PER_COMMAND of them is
+logged along with where they came from, as it's likely loading rows one by one.
+Anything else, like cache hit counts or the chart queue depth, is read when the metrics
+are collected through metrics.gauge.
+"""
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import logging
+import time
+
+from decouple import config
+
+
+# seconds, Prometheus' default buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "gainsworth_"
+# 0 turns the check off
+MAX_QUERIES_PER_COMMAND = config("MAX_QUERIES_PER_COMMAND", default=20, cast=int)
+
+_invocation = ContextVar("invocation", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last slot counts everything above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, inf past the last one."""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float("inf")
+
+
+class Invocation:
+    """Time spent per phase and statements run by one run of a command."""
+    def __init__(self, command):
+        self.command = command
+        self.phases = Counter()
+        self.queries = 0
+        # call site -> statements
+        self.sites = Counter()
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = defaultdict(Histogram)
+        # (command, "ok" or "error") -> runs
+        self.commands = Counter()
+        # command -> statements run
+        self.queries = Counter()
+        # command -> runs with more than MAX_QUERIES_PER_COMMAND statements
+        self.query_heavy = Counter()
+        self.logger = logging.getLogger(__name__)
+        self._gauges = {}
+
+    @contextmanager
+    def track(self, command):
+        invocation = Invocation(command)
+        token = _invocation.set(invocation)
+        status = "error"
+        start = time.perf_counter()
+        try:
+            yield invocation
+            status = "ok"
+        finally:
+            _invocation.reset(token)
+            self.latency[command, "total"].observe(time.perf_counter() - start)
+            for phase, seconds in invocation.phases.items():
+                self.latency[command, phase].observe(seconds)
+            self.commands[command, status] += 1
+            self.queries[command] += invocation.queries
+            if MAX_QUERIES_PER_COMMAND and invocation.queries > MAX_QUERIES_PER_COMMAND:
+                self.query_heavy[command] += 1
+                sites = ", ".join(f"{count}x {site}"
+                                  for site, count in invocation.sites.most_common(3))
+                self.logger.warning(f"{command} ran {invocation.queries} statements,"
+                                    f" most from {sites}")
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the time spent in the block to the tracked command's phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            invocation = _invocation.get()
+            if invocation is not None:
+                invocation.phases[name] += time.perf_counter() - start
+
+    def record_query(self, site):
+        """Counts a statement against the tracked command, or under "other"."""
+        invocation = _invocation.get()
+        if invocation is None:
+            self.queries["other"] += 1
+            return
+        invocation.queries += 1
+        invocation.sites[site] += 1
+
+    def gauge(self, name, description, read, kind="gauge"):
+        """Registers a value read at collection time, kind being a Prometheus type."""
+        self._gauges[name] = (description, kind, read)
+
+    def gauges(self):
+        return {name: read() for name, (_, _, read) in self._gauges.items()}
+
+    def prometheus(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = [f"# HELP {PREFIX}command_seconds Time spent per command and phase.",
+                 f"# TYPE {PREFIX}command_seconds histogram"]
+        for (command, phase), histogram in sorted(self.latency.items()):
+            labels = f'command="{command}",phase="{phase}"'
+            seen = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                seen += count
+                lines.append(f'{PREFIX}command_seconds_bucket{{{labels},le="{bound}"}}'
+                             f' {seen}')
+            lines.append(f"{PREFIX}command_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{PREFIX}command_seconds_count{{{labels}}} {histogram.count}")
+        lines += [f"# HELP {PREFIX}commands_total Commands run, by outcome.",
+                  f"# TYPE {PREFIX}commands_total counter"]
+        lines += [f'{PREFIX}commands_total{{command="{command}",status="{status}"}}'
+                  f' {count}'
+                  for (command, status), count in sorted(self.commands.items())]
+        lines += [f"# HELP {PREFIX}db_queries_total"
+                  " Database statements run, by command.",
+                  f"# TYPE {PREFIX}db_queries_total counter"]
+        lines += [f'{PREFIX}db_queries_total{{command="{command}"}} {count}'
+                  for command, count in sorted(self.queries.items())]
+        lines += [f"# HELP {PREFIX}query_heavy_runs_total"
+                  f" Runs of a command with more than {MAX_QUERIES_PER_COMMAND}"
+                  " database statements.",
+                  f"# TYPE {PREFIX}query_heavy_runs_total counter"]
+        lines += [f'{PREFIX}query_heavy_runs_total{{command="{command}"}} {count}'
+                  for command, count in sorted(self.query_heavy.items())]
+        for name, (description, kind, read) in sorted(self._gauges.items()):
+            lines += [f"# HELP {PREFIX}{name} {description}",
+                      f"# TYPE {PREFIX}{name} {kind}",
+                      f"{PREFIX}{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        self.latency.clear()
+        self.commands.clear()
+        self.queries.clear()
+        self.query_heavy.clear()
+
+
+def timed(callback):
+    """Tracks every run of an app command callback under its name."""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with metrics.track(callback.__name__):
+            return await callback(*args, **kwargs)
+    return wrapper
+
+
+metrics = Metrics()
@@ -0,0 +1,34 @@
+"""
+Opt-in sharding. With SHARDED=True the bot is an AutoShardedBot running SHARD_IDS
+(all shards by default) out of SHARD_COUNT (Discord's recommendation by default), so
+several processes can each run a range of shards. Work that isn't tied to a guild, like
+the inactive user purge, must only run in one of them, see runs_global_jobs. The
+processes share the database but nothing in memory, so caches that commands invalidate
+in the process running them can go stale, see runs_some_shards.
+"""
+from decouple import Csv, config
+
+
+SHARDED = config("SHARDED", default=False, cast=bool)
+SHARD_COUNT = config("SHARD_COUNT", default=0, cast=int) or None
+SHARD_IDS = config("SHARD_IDS", default="", cast=Csv(int)) or None
+
+
+def shard_options():
+    """Keyword arguments for the bot's constructor."""
+    if not SHARDED:
+        return {}
+    return {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS}
+
+
+def runs_global_jobs(client):
+    """Whether this process runs bot-wide jobs: it's unsharded or it holds shard 0."""
+    shard_ids = getattr(client, "shard_ids", None)
+    return shard_ids is None or 0 in shard_ids
+
+
+def runs_some_shards():
+    """Whether other processes may run the rest of the shards."""
+    if not SHARDED or SHARD_IDS is None:
+        return False
+    return SHARD_COUNT is None or set(SHARD_IDS) != set(range(SHARD_COUNT))
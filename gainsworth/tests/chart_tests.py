@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from gainsworth import sharding
+from gainsworth.charts.backends import BACKENDS
+from gainsworth.charts.buckets import pick_bucket
+from gainsworth.charts.cache import ChartCache
+from gainsworth.charts.pool import ChartRenderer
+from gainsworth.charts.render import fill_gaps, render_chart
+
+
+def gains_frame(rows):
+    # the frame render_chart builds from crud.daily_gains rows
+    return pd.DataFrame.from_records(rows, columns=["date", "name", "reps"]) \
+             .astype({"date": "datetime64[ns]", "name": "category", "reps": "float64"})
+
+
+def test_chart_cache_key_follows_data_version():
+    cache = ChartCache()
+    key = cache.key(1, 7, "line", "Pushups Jogging")
+    assert key == cache.key(1, 7, "line", "Jogging, Pushups")
+    asyncio.run(cache.put(key, b"png"))
+    assert asyncio.run(cache.get(key)) == b"png"
+    cache.bump(1)
+    assert cache.key(1, 7, "line", "Pushups Jogging") != key
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+@pytest.mark.parametrize("sharded, count, ids, split", [
+    (False, 4, [0, 1], False),
+    (True, None, None, False),
+    (True, 4, [0, 1, 2, 3], False),
+    (True, 4, [0, 1], True),
+    (True, None, [0, 1], True),
+])
+def test_split_shards_are_spotted(monkeypatch, sharded, count, ids, split):
+    monkeypatch.setattr(sharding, "SHARDED", sharded)
+    monkeypatch.setattr(sharding, "SHARD_COUNT", count)
+    monkeypatch.setattr(sharding, "SHARD_IDS", ids)
+    assert sharding.runs_some_shards() is split
+
+
+def test_disabled_chart_cache_keeps_nothing():
+    cache = ChartCache(maxsize=0)
+    key = cache.key(1, 7, "line", "Pushups")
+    asyncio.run(cache.put(key, b"png"))
+    assert asyncio.run(cache.get(key)) is None
+    assert len(cache) == 0
+
+
+def test_chart_cache_spills_to_disk(tmp_path):
+    cache = ChartCache(maxsize=1, disk_dir=tmp_path, disk_size=1)
+
+    async def fill():
+        await cache.put("a", b"first")
+        await cache.put("b", b"second")
+        spilled = await cache.get("a")
+        await cache.put("c", b"third")
+        return spilled, await cache.get("b"), await cache.get("a")
+
+    assert asyncio.run(fill()) == (b"first", None, b"first")
+    assert len(cache) == 1
+
+
+def test_long_windows_get_coarser_buckets():
+    assert [pick_bucket(days, 120) for days in (7, 119, 365, 3650, 36500)] == \
+        ["day", "day", "week", "month", "year"]
+
+
+def test_fill_gaps_has_a_row_per_day_and_activity():
+    gains = gains_frame([(date(2024, 3, 2), "Pushups", 10.0),
+                         (date(2024, 3, 2), "Pushups", 5.0),
+                         (date(2024, 3, 4), "Jogging", 30.0)])
+    filled = fill_gaps(gains, pd.Timestamp(2024, 3, 1), pd.Timestamp(2024, 3, 5))
+    assert len(filled) == 5 * 2
+    assert not filled.reset_index().duplicated(["date", "name"]).any()
+    totals = {(day.day, name): reps for day, name, reps in
+              filled.reset_index().itertuples(index=False)}
+    assert totals[2, "Pushups"] == 15.0
+    assert totals[4, "Jogging"] == 30.0
+    assert totals[1, "Pushups"] == totals[5, "Jogging"] == totals[2, "Jogging"] == 0.0
+
+
+def test_fill_gaps_sums_per_week_and_month():
+    gains = gains_frame([(date(2024, 3, 3), "Pushups", 1.0),
+                         (date(2024, 3, 4), "Pushups", 2.0),
+                         (date(2024, 3, 10), "Pushups", 3.0),
+                         (date(2024, 5, 20), "Pushups", 4.0)])
+    weekly = fill_gaps(gains, pd.Timestamp(2024, 3, 1), pd.Timestamp(2024, 3, 17),
+                       "W-SUN")
+    # weeks end on Sunday, so they're labelled by their Monday
+    assert list(weekly.index.day) == [26, 4, 11]
+    assert list(weekly["reps"]) == [1.0, 5.0, 0.0]
+    monthly = fill_gaps(gains, pd.Timestamp(2024, 3, 1), pd.Timestamp(2024, 5, 31), "M")
+    assert list(monthly.index.month) == [3, 4, 5]
+    assert list(monthly["reps"]) == [6.0, 0.0, 4.0]
+
+
+def test_empty_gains_still_render():
+    filled = fill_gaps(gains_frame([]), pd.Timestamp(2024, 3, 1),
+                       pd.Timestamp(2024, 3, 5))
+    assert filled.empty
+    assert render_chart([], 7, "line").startswith(b"\x89PNG")
+
+
+def test_renderer_refuses_unknown_backends():
+    with pytest.raises(ValueError):
+        ChartRenderer(backend="excel")
+
+
+def test_failed_warm_up_is_logged(monkeypatch, caplog):
+    monkeypatch.setitem(BACKENDS, "broken", "gainsworth.charts.no_such_backend")
+    renderer = ChartRenderer(backend="broken")
+    # a thread runs the worker side in this process, where the patched backend is seen
+    renderer._executor.shutdown()
+    renderer._executor = ThreadPoolExecutor(1)
+    asyncio.run(renderer.start())
+    asyncio.run(renderer.close())
+    assert "failed to warm up broken: ModuleNotFoundError" in caplog.text
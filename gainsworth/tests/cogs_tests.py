@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from gainsworth.cogs.gainsworth_core import Gainsworth, broadcast_channel
+from gainsworth.cogs.gainsworth_memory import GainsMemory
+from gainsworth.cogs.gainsworth_vision import GainsVision
+from gainsworth.db import crud
+from gainsworth.tests.helpers import StubClient, StubInteraction, max_queries, run
+
+pytestmark = pytest.mark.usefixtures("database")
+
+
+def call(command, cog, *args):
+    """Runs an app command's callback with a stub interaction, returns what it sent."""
+    interaction = StubInteraction()
+    asyncio.run(command.callback(cog, interaction, *args))
+    return interaction.messages
+
+
+def test_add_gains_runs_the_same_statements_for_any_number_of_gains():
+    memory = GainsMemory(StubClient())
+    for name in ("Pushups", "Situps", "Jogging"):
+        call(GainsMemory.create_activity, memory, name)
+    with max_queries(4):
+        sent = call(GainsMemory.add_gains, memory, "10 Pushups")
+    with max_queries(4):
+        call(GainsMemory.add_gains, memory, "10 Pushups 5 Situps 30 Jogging")
+    assert "10 Pushups" in sent[0]
+
+
+def test_registered_users_are_not_looked_up_again():
+    memory = GainsMemory(StubClient())
+    # looking up, then registering, a new user
+    with max_queries(3 + 1):
+        sent = call(GainsMemory.list_activities, memory)
+    with max_queries(1):
+        call(GainsMemory.list_activities, memory)
+    assert "haven't created any activities" in sent[0]
+
+
+def test_list_gains_statements():
+    memory = GainsMemory(StubClient())
+    call(GainsMemory.create_activity, memory, "Pushups")
+    call(GainsMemory.add_gains, memory, "10 Pushups")
+    with max_queries(2):
+        sent = call(GainsMemory.list_gains, memory, 7)
+    assert "10.00 Pushups" in sent[0]
+
+
+class StubChannel:
+    def __init__(self, channel_id, can_send=True, fails=False):
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+        self.can_send = can_send
+        self.fails = fails
+        self.sent = []
+
+    def permissions_for(self, member):
+        return SimpleNamespace(view_channel=True, send_messages=self.can_send)
+
+    async def send(self, content):
+        if self.fails:
+            raise RuntimeError("connection reset")
+        self.sent.append(content)
+
+
+def stub_guild(guild_id, *text_channels, system_channel=None):
+    return SimpleNamespace(id=guild_id, name=f"guild-{guild_id}", me=object(),
+                           system_channel=system_channel,
+                           text_channels=list(text_channels))
+
+
+def test_broadcast_channel_prefers_the_system_channel():
+    system, first, second = StubChannel(1), StubChannel(2, can_send=False), \
+        StubChannel(3)
+    guild = stub_guild(1, first, second, system_channel=system)
+    assert broadcast_channel(guild) is system
+    guild.system_channel = StubChannel(4, can_send=False)
+    assert broadcast_channel(guild) is second
+    assert broadcast_channel(stub_guild(1, first)) is None
+
+
+def test_broadcast_resumes_where_it_stopped():
+    delivered, pending = StubChannel(1), StubChannel(2)
+    failing = StubChannel(3, fails=True)
+    guilds = [stub_guild(1, delivered), stub_guild(2, pending), stub_guild(3, failing)]
+    core = Gainsworth(StubClient(guilds))
+
+    async def record(ses):
+        await crud.record_delivery(ses, "9.9.0", 1, 1, "sent")
+        await ses.commit()
+
+    run(record)
+    assert asyncio.run(core.broadcast_changelog("## 9.9.0", version="9.9.0")) is False
+    assert (delivered.sent, len(pending.sent)) == ([], 1)
+
+    async def delivered_guilds(ses):
+        return await crud.delivered_guilds(ses, "9.9.0")
+
+    # the failed guild isn't recorded, so the next run retries it
+    assert run(delivered_guilds) == {1, 2}
+    failing.fails = False
+    assert asyncio.run(core.broadcast_changelog("## 9.9.0", version="9.9.0")) is True
+    assert (len(pending.sent), len(failing.sent)) == (1, 1)
+
+
+def test_see_gains_reports_a_failed_load(monkeypatch):
+    client = StubClient()
+    client.cogs["GainsMemory"] = GainsMemory(client)
+    vision = GainsVision(client)
+
+    async def unreachable(*args, **kwargs):
+        raise ConnectionError("database went away")
+
+    monkeypatch.setattr(crud, "daily_gains", unreachable)
+    sent = call(GainsVision.see_gains, vision, 7, "line", "")
+    asyncio.run(vision.renderer.close())
+    assert sent == ["Sorry gainer, I couldn't load your gains right now! Please try"
+                    " `/see_gains` again in a minute."]
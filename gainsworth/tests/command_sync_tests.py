@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from gainsworth.command_sync import SYNC_STATE_KEY, sync_if_changed, tree_hash
+from gainsworth.db import crud
+from gainsworth.tests.helpers import run
+
+pytestmark = pytest.mark.usefixtures("database")
+
+
+class StubCommand:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def to_dict(self):
+        return {"type": 1, "name": self.name, "description": self.description,
+                "options": []}
+
+
+class StubTree:
+    """Stands in for an app_commands.CommandTree, counting syncs."""
+    def __init__(self, *commands):
+        self.commands = list(commands)
+        self.syncs = 0
+
+    def get_commands(self):
+        return self.commands
+
+    async def sync(self):
+        self.syncs += 1
+        return self.commands
+
+
+def stub_tree(description="Adds gains"):
+    return StubTree(StubCommand("add_gains", description),
+                    StubCommand("see_gains", "Shows gains"))
+
+
+def test_tree_hash_ignores_registration_order():
+    tree = stub_tree()
+    assert tree_hash(tree) == tree_hash(StubTree(*reversed(tree.commands)))
+    assert tree_hash(tree) != tree_hash(stub_tree("Adds reps"))
+
+
+def test_unchanged_tree_is_not_synced_again():
+    tree = stub_tree()
+    assert asyncio.run(sync_if_changed(tree)) is True
+    assert asyncio.run(sync_if_changed(StubTree(*reversed(tree.commands)))) is False
+    assert tree.syncs == 1
+    assert run(lambda ses: crud.get_state(ses, SYNC_STATE_KEY)) == tree_hash(tree)
+
+
+def test_changed_description_is_synced():
+    asyncio.run(sync_if_changed(stub_tree()))
+    changed = stub_tree("Adds reps")
+    assert asyncio.run(sync_if_changed(changed)) is True
+    assert changed.syncs == 1
+
+
+def test_forced_sync_always_syncs():
+    tree = stub_tree()
+    asyncio.run(sync_if_changed(tree))
+    assert asyncio.run(sync_if_changed(tree, force=True)) is True
+    assert tree.syncs == 2
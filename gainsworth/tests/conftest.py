@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from gainsworth.db import crud
+from gainsworth.db.cache import identity_cache
+from gainsworth.db.models import Base
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    """A fresh SQLite database for the shared engine, and an empty identity cache."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'gains.db'}")
+    identity_cache.clear()
+
+    async def create():
+        async with crud.get_engine().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    yield
+    asyncio.run(crud.dispose_engine())
+    identity_cache.clear()
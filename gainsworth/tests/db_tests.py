@@ -0,0 +1,415 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from gainsworth.db import crud, profiling
+from gainsworth.db.buffer import GainBuffer
+from gainsworth.db.cache import CachedUser, IdentityCache
+from gainsworth.db.models import DailyGain, ExerciseArchive, User
+from gainsworth.metrics import metrics
+from gainsworth.tests.helpers import gain, max_queries, run
+
+pytestmark = pytest.mark.usefixtures("database")
+
+
+def test_engine_is_shared():
+    assert crud.get_engine() is crud.get_engine()
+
+
+def test_register_user_is_idempotent():
+    async def register(ses):
+        first = await crud.register_user(ses, 42, "gainer#0001")
+        second = await crud.register_user(ses, 42, "gainer#0002")
+        return first.id, second.id, second.name
+
+    first_id, second_id, name = run(register)
+    assert first_id == second_id
+    assert name == "gainer#0002"
+
+
+def test_register_user_keeps_reused_names_apart():
+    async def register(ses):
+        owner = await crud.register_user(ses, 111, "bob#0")
+        await crud.create_activity(ses, owner.id, "Pushups")
+        ses.add(User(name="legacy#0", user_id=0))
+        await ses.commit()
+        newcomer = await crud.register_user(ses, 222, "bob#0")
+        legacy = await crud.register_user(ses, 333, "legacy#0")
+        return (owner.id, newcomer.id, newcomer.user_id,
+                await crud.list_activities(ses, newcomer.id), legacy.user_id,
+                await ses.scalar(select(func.count()).select_from(User)))
+
+    owner_id, newcomer_id, discord_id, activities, legacy_id, users = run(register)
+    assert newcomer_id != owner_id
+    assert (discord_id, activities) == (222, [])
+    # the legacy row is adopted rather than duplicated
+    assert (legacy_id, users) == (333, 3)
+
+
+def test_gains_are_summed_per_activity():
+    async def log(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        jogging = await crud.create_activity(ses, user.id, "Jogging", "minutes")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10"),
+                                      gain(user, pushups, "15"),
+                                      gain(user, jogging, "30")])
+        await ses.commit()
+        return await crud.sum_gains(ses, user.id, datetime.utcnow() - timedelta(days=7))
+
+    totals = {name: (unit, float(reps)) for name, unit, reps in run(log)}
+    assert totals == {"Pushups": (None, 25.0), "Jogging": ("minutes", 30.0)}
+
+
+def test_rebuilt_rollup_matches_incremental_rollup():
+    async def log(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10"),
+                                      gain(user, pushups, "15")])
+        await crud.record_gains(ses, [gain(user, pushups, "-5")])
+        await ses.commit()
+        incremental = await crud.daily_gains(ses, user.id)
+        await crud.rebuild_daily_gains(ses)
+        await ses.commit()
+        return incremental, await crud.daily_gains(ses, user.id)
+
+    incremental, rebuilt = run(log)
+    assert incremental == rebuilt
+    assert [float(reps) for _, _, reps in rebuilt] == [20.0]
+
+
+def test_daily_gains_filters_by_day_and_name():
+    async def log(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        jogging = await crud.create_activity(ses, user.id, "Jogging", "minutes")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10", datetime(2020, 1, 5)),
+                                      gain(user, pushups, "5"),
+                                      gain(user, jogging, "30")])
+        await ses.commit()
+        return await crud.daily_gains(ses, user.id, date(2021, 1, 1), ["Pushups"])
+
+    assert [(name, float(reps)) for _, name, reps in run(log)] == [("Pushups", 5.0)]
+
+
+def test_daily_gains_sums_per_week():
+    async def log(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.flush()
+        # a Sunday, then Monday and Tuesday of the week after
+        await crud.record_gains(ses, [gain(user, pushups, "1", datetime(2024, 3, 3)),
+                                      gain(user, pushups, "2", datetime(2024, 3, 4)),
+                                      gain(user, pushups, "3", datetime(2024, 3, 5))])
+        await ses.commit()
+        return await crud.daily_gains(ses, user.id, bucket="week")
+
+    assert [(day, float(reps)) for day, _, reps in run(log)] == \
+        [(date(2024, 2, 26), 1.0), (date(2024, 3, 4), 5.0)]
+
+
+def test_archived_months_stay_in_rollup():
+    async def archive(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10", datetime(2020, 1, 5)),
+                                      gain(user, pushups, "5", datetime(2020, 1, 9)),
+                                      gain(user, pushups, "7")])
+        await ses.commit()
+        month = await crud.oldest_exercise_month(ses)
+        archived = await crud.archive_exercise_month(ses, month)
+        await crud.rebuild_daily_gains(ses)
+        await ses.commit()
+        blob = await ses.scalar(select(ExerciseArchive))
+        return (month, archived, await crud.oldest_exercise_month(ses),
+                crud.unpack_archive(blob),
+                await crud.sum_gains(ses, user.id, datetime(2019, 1, 1)))
+
+    month, archived, oldest, rows, totals = run(archive)
+    assert (month, archived) == (date(2020, 1, 1), 2)
+    assert oldest == datetime.utcnow().date().replace(day=1)
+    assert [(name, reps) for name, _, reps, _ in rows] == \
+        [("Pushups", 10), ("Pushups", 5)]
+    assert [float(total) for _, _, total in totals] == [22.0]
+
+
+def test_archiving_fills_the_rollup_and_rebuilds_read_the_archive():
+    async def archive(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10", datetime(2020, 1, 5)),
+                                      gain(user, pushups, "3")])
+        # as if the rollup predated these gains
+        await ses.execute(delete(DailyGain))
+        await crud.archive_exercise_month(ses, date(2020, 1, 1))
+        await ses.commit()
+        archived = await crud.sum_gains(ses, user.id, datetime(2019, 1, 1))
+        await crud.rebuild_daily_gains(ses)
+        await ses.commit()
+        return archived, await crud.sum_gains(ses, user.id, datetime(2019, 1, 1))
+
+    archived, rebuilt = run(archive)
+    assert [float(total) for _, _, total in archived] == [10.0]
+    assert [float(total) for _, _, total in rebuilt] == [13.0]
+
+
+def test_delete_activity_removes_archived_gains():
+    async def remove(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        situps = await crud.create_activity(ses, user.id, "Situps")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10", datetime(2020, 1, 5)),
+                                      gain(user, situps, "5", datetime(2020, 1, 6)),
+                                      gain(user, pushups, "7")])
+        await crud.archive_exercise_month(ses, date(2020, 1, 1))
+        await ses.commit()
+        removed = await crud.delete_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        blob = await ses.scalar(select(ExerciseArchive))
+        rows = [(name, reps) for name, _, reps, _ in crud.unpack_archive(blob)]
+        removed_situps = await crud.delete_activity(ses, user.id, "Situps")
+        await ses.commit()
+        blobs = await ses.scalar(select(func.count()).select_from(ExerciseArchive))
+        return removed, blob.row_count, rows, removed_situps, blobs
+
+    assert run(remove) == (2, 1, [("Situps", 5)], 1, 0)
+
+
+def test_inactive_users_skips_active_and_saved_users():
+    async def find(ses):
+        idle = await crud.register_user(ses, 1, "idle#0001")
+        saved = await crud.register_user(ses, 2, "saved#0001")
+        await crud.register_user(ses, 3, "active#0001")
+        idle.last_active = saved.last_active = datetime.utcnow() - timedelta(weeks=60)
+        await crud.set_auto_remove(ses, saved.id, False)
+        await ses.commit()
+        cutoff = datetime.utcnow() - timedelta(weeks=52)
+        batch = await crud.inactive_users(ses, cutoff, 10)
+        removed = await crud.delete_users(ses, [user.id for user in batch])
+        await ses.commit()
+        return [user.user_id for user in batch], removed
+
+    assert run(find) == ([1], 1)
+
+
+def test_delete_user_cascades():
+    async def remove(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        await crud.create_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        await crud.delete_user(ses, user.id)
+        await ses.commit()
+        return await crud.has_activities(ses, user.id)
+
+    assert run(remove) is False
+
+
+def test_delete_activity_counts_only_gains():
+    async def remove(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.flush()
+        await crud.record_gains(ses, [gain(user, pushups, "10")])
+        await ses.commit()
+        removed = await crud.delete_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        return removed, await crud.list_activities(ses, user.id)
+
+    assert run(remove) == (1, [])
+
+
+def test_broadcast_deliveries_are_kept_per_version():
+    async def deliver(ses):
+        await crud.record_delivery(ses, "0.6.0", 1, 10, "sent")
+        await crud.record_delivery(ses, "0.6.0", 2, None, "no_channel")
+        await crud.record_delivery(ses, "0.6.0", 2, 20, "sent")
+        await crud.record_delivery(ses, "0.5.0", 3, 30, "sent")
+        await ses.commit()
+        return await crud.delivered_guilds(ses, "0.6.0")
+
+    assert run(deliver) == {1, 2}
+
+
+def test_queries_are_counted_per_command():
+    async def log(ses):
+        # two lookups and an insert
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        with metrics.track("list_activities"):
+            await crud.user_activities(ses, user.id)
+            await crud.list_activities(ses, user.id)
+
+    metrics.clear()
+    run(log)
+    assert dict(metrics.queries) == {"other": 3, "list_activities": 2}
+
+
+def test_recording_gains_does_not_query_per_gain():
+    async def log(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        situps = await crud.create_activity(ses, user.id, "Situps")
+        await ses.commit()
+        with max_queries(3):
+            await crud.record_gains(ses, [gain(user, activity, "1")
+                                          for activity in [pushups, situps] * 50])
+        await ses.commit()
+
+    run(log)
+
+
+def test_statements_are_logged_with_their_call_site(monkeypatch, caplog):
+    async def look_up(ses):
+        await crud.get_user(ses, 42)
+
+    monkeypatch.setattr(profiling, "SLOW_QUERY_MS", 0)
+    run(look_up)
+    assert "from db_tests.py:" in caplog.text
+    assert "look_up > crud.py:" in caplog.text
+    assert " get_user: SELECT users.id" in caplog.text
+
+
+def test_bot_state_is_overwritten():
+    async def remember(ses):
+        missing = await crud.get_state(ses, "command_tree_hash")
+        await crud.set_state(ses, "command_tree_hash", "abc")
+        await crud.set_state(ses, "command_tree_hash", "def")
+        await ses.commit()
+        return missing, await crud.get_state(ses, "command_tree_hash")
+
+    assert run(remember) == (None, "def")
+
+
+def test_buffered_gains_survive_a_crash(tmp_path):
+    journal = tmp_path / "gains.journal"
+
+    async def crash(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        situps = await crud.create_activity(ses, user.id, "Situps")
+        await ses.commit()
+        buffer = GainBuffer(journal, interval=60)
+        await buffer.start()
+        await buffer.put([gain(user, pushups, "10"), gain(user, situps, "5")])
+        await buffer.put([gain(user, pushups, "15")])
+        # never stopped, so nothing was flushed
+        await crud.delete_activity(ses, user.id, "Situps")
+        await ses.commit()
+        return user.id
+
+    async def restart(ses):
+        buffer = GainBuffer(journal, interval=60)
+        await buffer.start()
+        await buffer.stop()
+        return await crud.sum_gains(ses, user_id, datetime.utcnow() - timedelta(days=1))
+
+    user_id = run(crash)
+    totals = run(restart)
+    assert [(name, float(reps)) for name, _, reps in totals] == [("Pushups", 25.0)]
+    assert not journal.exists()
+
+
+def test_refused_gains_are_set_aside(tmp_path):
+    journal = tmp_path / "gains.journal"
+
+    async def flush(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        buffer = GainBuffer(journal, interval=60)
+        with pytest.raises(ValueError):
+            await buffer.put([gain(user, pushups, "NaN")])
+        await buffer.put([gain(user, pushups, "10")])
+        # as if replayed from a journal written before amounts were checked
+        buffer.queue.put_nowait(gain(user, pushups, "NaN"))
+        await buffer.put([gain(user, pushups, "5")])
+        written = await buffer.flush(), await buffer.flush()
+        totals = await crud.sum_gains(ses, user.id,
+                                      datetime.utcnow() - timedelta(days=1))
+        return written, [float(reps) for _, _, reps in totals]
+
+    assert run(flush) == ((2, 0), [15.0])
+    dead = (tmp_path / "gains.journal.dead").read_text().splitlines()
+    assert len(dead) == 1 and '"reps": "NaN"' in dead[0]
+    assert not (tmp_path / "gains.journal.flushing").exists()
+
+
+def test_replay_skips_a_line_cut_short(tmp_path):
+    journal = tmp_path / "gains.journal"
+
+    async def replay(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        await GainBuffer(journal).put([gain(user, pushups, "10"),
+                                       gain(user, pushups, "5")])
+        # as left by a crash halfway through appending the second gain
+        journal.write_text(journal.read_text()[:-30])
+        buffer = GainBuffer(journal, interval=60)
+        await buffer.start()
+        await buffer.put([gain(user, pushups, "15")])
+        await buffer.stop()
+        totals = await crud.sum_gains(ses, user.id,
+                                      datetime.utcnow() - timedelta(days=1))
+        return [float(reps) for _, _, reps in totals]
+
+    assert run(replay) == [25.0]
+    assert not journal.exists()
+    assert not (tmp_path / "gains.journal.flushing").exists()
+
+
+def test_flusher_outlives_a_failed_flush(tmp_path, monkeypatch):
+    async def flush(ses):
+        user = await crud.register_user(ses, 42, "gainer#0001")
+        pushups = await crud.create_activity(ses, user.id, "Pushups")
+        await ses.commit()
+        buffer = GainBuffer(tmp_path / "gains.journal", interval=0.01)
+        await buffer.start()
+        rotate, failures = buffer._rotate, []
+
+        def full_disk():
+            if not failures:
+                failures.append(True)
+                raise OSError("No space left on device")
+            rotate()
+
+        monkeypatch.setattr(buffer, "_rotate", full_disk)
+        await buffer.put([gain(user, pushups, "10")])
+        totals = []
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            totals = await crud.sum_gains(ses, user.id,
+                                          datetime.utcnow() - timedelta(days=1))
+            if totals:
+                break
+        alive = not buffer._task.done()
+        await buffer.stop()
+        return alive, failures, [float(reps) for _, _, reps in totals]
+
+    assert run(flush) == (True, [True], [10.0])
+
+
+def test_identity_cache_evicts_least_recently_used():
+    cache = IdentityCache(maxsize=2)
+    cache.put(CachedUser(1, 101, "a#0001", True))
+    cache.put(CachedUser(2, 102, "b#0001", True))
+    cache.get(101)
+    cache.put(CachedUser(3, 103, "c#0001", True))
+    assert cache.get(102) is None
+    assert cache.get(101).id == 1
+    cache.invalidate(101)
+    assert cache.get(101) is None
+
+
+def test_identity_cache_expires_entries():
+    cache = IdentityCache(ttl=-1)
+    cache.put(CachedUser(1, 101, "a#0001", True))
+    assert cache.get(101) is None
@@ -0,0 +1,81 @@
+"""Helpers shared by the test modules, see also the database fixture in conftest.py."""
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from gainsworth.db import crud
+from gainsworth.metrics import metrics
+
+
+def gain(user, activity, amount, date=None):
+    return {"user_id": user.id,
+            "activity_id": activity.id,
+            "reps": Decimal(amount),
+            "date": date or datetime.utcnow()}
+
+
+def run(coro):
+    """Runs coro(session) on a new event loop and returns its result."""
+    async def wrapped():
+        async with crud.get_session() as ses:
+            return await coro(ses)
+    return asyncio.run(wrapped())
+
+
+@contextmanager
+def max_queries(n):
+    """
+    Fails the test if the block runs more than n database statements, counted by
+    command (commands run in the block count under their own name, the rest as "other").
+    """
+    before = Counter(metrics.queries)
+    yield
+    ran = Counter(metrics.queries)
+    ran.subtract(before)
+    ran = +ran
+    assert sum(ran.values()) <= n, f"ran {sum(ran.values())} statements: {dict(ran)}"
+
+
+class StubUser:
+    def __init__(self, user_id=42, name="gainer"):
+        self.id = user_id
+        self.name = name
+        self.discriminator = "0001"
+
+
+class StubResponse:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content or kwargs)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class StubFollowup(StubResponse):
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content or kwargs)
+
+
+class StubInteraction:
+    """Just enough of a discord.Interaction for calling a command's callback."""
+    def __init__(self, user=None):
+        self.user = user or StubUser()
+        self.guild = None
+        self.messages = []
+        self.response = StubResponse(self.messages)
+        self.followup = StubFollowup(self.messages)
+
+
+class StubClient:
+    def __init__(self, guilds=()):
+        self.user = object()
+        self.guilds = list(guilds)
+        self.cogs = {}
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+
+from gainsworth import logs
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], logging.getLogger("gainsworth").level
+    yield root
+    root.handlers = handlers
+    logging.getLogger("gainsworth").setLevel(level)
+
+
+def test_parse_levels():
+    assert logs.parse_levels(["gainsworth=debug", " discord = WARNING", "INFO"]) == \
+        {"gainsworth": "DEBUG", "discord": "WARNING", None: "INFO"}
+
+
+def test_log_file_rotates_by_size(monkeypatch, tmp_path, root_logger):
+    monkeypatch.setattr(logs, "LOG_FILE", str(tmp_path / "gainsworth_debug.log"))
+    monkeypatch.setattr(logs, "LOG_MAX_BYTES", 1000)
+    monkeypatch.setattr(logs, "LOG_BACKUPS", 2)
+    writer = logs.setup_logging()
+    writer.start()
+    for i in range(100):
+        logging.getLogger("gainsworth.tests").debug(f"gain number {i}")
+    writer.stop()
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert files == ["gainsworth_debug.log", "gainsworth_debug.log.1",
+                     "gainsworth_debug.log.2"]
+    assert "gain number 99" in (tmp_path / "gainsworth_debug.log").read_text()
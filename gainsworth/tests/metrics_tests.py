@@ -0,0 +1,57 @@
+import pytest
+
+from gainsworth import metrics as metrics_module
+from gainsworth.metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(seconds)
+    assert histogram.counts == [2, 1, 1]
+    assert (histogram.quantile(0.5), histogram.quantile(0.75)) == (0.1, 1.0)
+    assert histogram.quantile(1) == float("inf")
+
+
+def test_track_records_phases_and_failures():
+    metrics = Metrics()
+    with metrics.track("see_gains"):
+        with metrics.phase("db"):
+            pass
+        with metrics.phase("db"):
+            pass
+    with pytest.raises(ValueError):
+        with metrics.track("see_gains"):
+            raise ValueError()
+    # phases outside a tracked command are timed but go nowhere
+    with metrics.phase("render"):
+        pass
+    assert metrics.latency["see_gains", "total"].count == 2
+    assert metrics.latency["see_gains", "db"].count == 1
+    assert dict(metrics.commands) == {("see_gains", "ok"): 1, ("see_gains", "error"): 1}
+
+
+def test_commands_running_many_statements_are_flagged(monkeypatch, caplog):
+    monkeypatch.setattr(metrics_module, "MAX_QUERIES_PER_COMMAND", 2)
+    metrics = Metrics()
+    with metrics.track("list_activities"):
+        for _ in range(3):
+            metrics.record_query("crud.py:141 user_activities")
+    with metrics.track("list_activities"):
+        metrics.record_query("crud.py:141 user_activities")
+    assert metrics.query_heavy["list_activities"] == 1
+    assert "list_activities ran 3 statements, most from 3x crud.py:141" in caplog.text
+
+
+def test_prometheus_text():
+    metrics = Metrics()
+    with metrics.track("add_gains"):
+        pass
+    metrics.gauge("chart_render_queue_depth", "Charts waiting for a free worker.",
+                  lambda: 3)
+    text = metrics.prometheus().splitlines()
+    assert ('gainsworth_command_seconds_bucket'
+            '{command="add_gains",phase="total",le="+Inf"} 1') in text
+    assert 'gainsworth_commands_total{command="add_gains",status="ok"} 1' in text
+    assert "# TYPE gainsworth_chart_render_queue_depth gauge" in text
+    assert "gainsworth_chart_render_queue_depth 3" in text